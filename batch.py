@@ -0,0 +1,139 @@
+''' Generates the gcode for many wing configs at once.
+
+    python batch.py kit/                      every .cfg file in kit/
+    python batch.py "kit/*_left.cfg" -o out   files matching a glob, written to out/
+    python batch.py kit/ -j 8                 8 worker processes
+
+    For every config <name>.cfg this writes <name>.gcode and <name>.json (the wing stats)
+    to the output directory, next to the config if none is given. Two configs with the same
+    name in different directories can not share one output directory.
+'''
+import argparse
+import concurrent.futures
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import config_options
+import gcode_gen
+import job_pool
+
+
+def find_configs(inputs):
+    ''' .cfg files in the given directories, glob patterns and files, in order and without duplicates '''
+    result = []
+    for i in inputs:
+        if os.path.isdir(i):
+            names = sorted(glob.glob(os.path.join(i, "*.cfg")))
+        else:
+            names = sorted(glob.glob(i)) or [i]
+        for n in names:
+            if n not in result:
+                result.append(n)
+    return result
+
+
+def output_name(config_filename):
+    ''' <name> of the <name>.gcode and <name>.json files written for config_filename '''
+    return os.path.splitext(os.path.basename(config_filename))[0]
+
+
+def check_output_names(config_filenames):
+    ''' raises an Exception if two configs would write the same files to one output directory '''
+    seen = {}
+    for c in config_filenames:
+        other = seen.setdefault(output_name(c), c)
+        if other != c:
+            raise Exception("%s and %s would both be written as %s.gcode" % (other, c, output_name(c)))
+
+
+def generate_file(config_filename, output_dir=None):
+    ''' Generates the gcode for one config file, runs in a worker process.
+        The profiles are read through the worker's ProfileCache, so each is loaded once per worker '''
+    start = time.perf_counter()
+    name = output_name(config_filename)
+    output_dir = output_dir or os.path.dirname(config_filename)
+    result = {'config': config_filename, 'gcode': None, 'lines': 0, 'seconds': 0., 'stats': None, 'error': None}
+
+    try:
+        with open(config_filename) as f:
+            cfg = config_options.Config.from_string(f.read())
+        if cfg.validation:
+            raise Exception("; ".join(cfg.validation))
+
+        gc_gen = gcode_gen.GcodeGen(cfg, job_pool.profile_cache())
+        gc, _, _ = gc_gen.gen_gcode()
+        stats = gc_gen.calc_wing_stats()
+
+        gcode_filename = os.path.join(output_dir, name + ".gcode")
+        with open(gcode_filename, "w") as f:
+            lines = gc.write_code(f)
+        with open(os.path.join(output_dir, name + ".json"), "w") as f:
+            json.dump(stats, f, indent=1)
+
+        result.update(gcode=gcode_filename, lines=lines, stats=stats)
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run(config_filenames, output_dir=None, workers=None, profile_path="profiles"):
+    ''' generates all the configs on a pool of worker processes, yields the results as they finish '''
+    if output_dir is not None:
+        check_output_names(config_filenames)
+        os.makedirs(output_dir, exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=job_pool.init_worker,
+                                                initargs=(profile_path,)) as executor:
+        futures = [executor.submit(generate_file, c, output_dir) for c in config_filenames]
+        for f in concurrent.futures.as_completed(futures):
+            yield f.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate gcode for a batch of wing config files")
+    parser.add_argument("inputs", nargs="+", help="config files, directories or glob patterns")
+    parser.add_argument("-o", "--output", default=None, help="output directory, default next to each config")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-p", "--profiles", default="profiles", help="profile cache directory")
+    args = parser.parse_args(argv)
+
+    configs = find_configs(args.inputs)
+    if not configs:
+        print("No config files found")
+        return 1
+    if args.output is not None:
+        try:
+            check_output_names(configs)
+        except Exception as e:
+            print(e)
+            return 1
+
+    start = time.perf_counter()
+    failed = 0
+    lines = 0
+    for r in run(configs, args.output, args.workers, args.profiles):
+        if r['error'] is not None:
+            failed += 1
+            print("FAILED %s: %s" % (r['config'], r['error']))
+        else:
+            lines += r['lines']
+            print("%-40s %8d lines %7.2fs  area %.0f  AR %.2f" % (r['gcode'], r['lines'], r['seconds'],
+                                                             r['stats']['wing_area'], r['stats']['aspect_ratio']))
+
+    elapsed = time.perf_counter() - start
+    done = len(configs) - failed
+    print("%d of %d configs in %.2fs with %d workers: %.2f configs/s, %.0f gcode lines/s" % (
+        done, len(configs), elapsed, args.workers, done / elapsed, lines / elapsed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
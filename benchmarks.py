@@ -0,0 +1,355 @@
+''' Micro benchmarks for the hot paths of the Draw callback.
+
+    python benchmarks.py                  runs all benchmarks
+    python benchmarks.py project_coords   runs only the named ones
+'''
+import concurrent.futures
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import numpy as np
+import plotly
+
+import re
+
+import dxf_parser
+import gcode_buffer
+import gcode_gen
+import gcode_formatter
+import plotting
+import simulation
+from utils import project_line
+
+
+def _best_of(fn, repeat=5):
+    ''' best wall time of repeat runs, in seconds '''
+    number = 1
+    # make sure short runs are timed over enough iterations
+    while timeit.timeit(fn, number=number) < 0.05 and number < 10000:
+        number *= 10
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def _fake_gcode(n):
+    ''' ParsedGcode with n points tracing an airfoil-ish loop on both machine sides '''
+    t = np.linspace(0, 2 * np.pi, n)
+    X = 200 + 150 * np.cos(t)
+    Y = 30 + 10 * np.sin(t)
+    U = 300 + 80 * np.cos(t)
+    V = 35 + 6 * np.sin(t)
+    return plotting.ParsedGcode(X, Y, U, V, [["profile"]] * n, ["MOVE"] * n)
+
+
+def _plotter():
+    return plotting.GcodePlotter(1490, 400, 490, 300, 450, 0, 50, 0, 450, None, None)
+
+
+def project_coords_loop(pgc, from_box, to_box):
+    ''' per point implementation GcodePlotter.project_coords replaced '''
+    X1, Y1, U1, V1 = [], [], [], []
+    for i in range(len(pgc)):
+        a = project_line(pgc.X[i], pgc.Y[i], pgc.U[i], pgc.V[i], from_box.width, to_box.left)
+        X1.append(a[1])
+        Y1.append(a[2])
+        b = project_line(pgc.X[i], pgc.Y[i], pgc.U[i], pgc.V[i], from_box.width, to_box.left + to_box.width)
+        U1.append(b[1])
+        V1.append(b[2])
+    return plotting.ParsedGcode(X1, Y1, U1, V1, pgc.TAG, pgc.KIND)
+
+
+def calc_vertices_loop(pgc, gbox, points):
+    ''' per point implementation GcodePlotter.calc_vertices replaced '''
+    x = np.zeros(points)
+    x = np.append(x, np.ones(points) * gbox.width)
+    x = x + gbox.left
+    y = np.append(np.array(pgc.X[:points], np.float64), np.array(pgc.U[:points]))
+    z = np.append(np.array(pgc.Y[:points], np.float64), np.array(pgc.V[:points], np.float64))
+
+    i, j, k = [], [], []
+    for a in range(points-1):
+        i.append(a)
+        j.append(a+points)
+        k.append(a+1)
+        i.append(a+points)
+        j.append(a+points+1)
+        k.append(a+1)
+
+    intensity = (x< gbox.left) | (x> gbox.left + gbox.width) \
+                | (y< gbox.inset) | (y>gbox.depth + gbox.inset) \
+                | (z< gbox.bottom) | (z > gbox.height + gbox.bottom)
+    intensity = np.array(intensity,float)
+    return {'x':np.round(x,2), 'y':np.round(y,2), 'z':np.round(z,2) , 'i':i, 'j':j, 'k':k, 'intensity':intensity}
+
+
+def bench_project_coords(sizes=(200, 2000, 20000)):
+    gplt = _plotter()
+    print("%8s %14s %14s %9s" % ("points", "loop (ms)", "numpy (ms)", "speedup"))
+    for n in sizes:
+        pgc = _fake_gcode(n)
+
+        def old():
+            projected = project_coords_loop(pgc, gplt.mbox, gplt.fbox)
+            return projected, calc_vertices_loop(projected, gplt.fbox, len(projected))
+
+        def new():
+            projected = gplt.project_coords(pgc, gplt.mbox, gplt.fbox)
+            return projected, gplt.calc_vertices(projected, gplt.fbox, len(projected))
+
+        # both implementations have to agree before timing them
+        (p_old, v_old), (p_new, v_new) = old(), new()
+        for ax in ("X", "Y", "U", "V"):
+            assert np.array_equal(getattr(p_old, ax), getattr(p_new, ax))
+        for ax in ("x", "y", "z", "i", "j", "k", "intensity"):
+            assert np.array_equal(v_old[ax], v_new[ax])
+
+        t_old, t_new = _best_of(old), _best_of(new)
+        print("%8d %14.3f %14.3f %8.1fx" % (n, t_old * 1000, t_new * 1000, t_old / t_new))
+
+
+def _fake_gcode_lines(n):
+    ''' n lines of 4 axis G-code as written by DxfToGCode.to_gcode '''
+    t = np.linspace(0, 2 * np.pi, n)
+    x = 100 + 100 * np.cos(t)
+    y = 12 * np.sin(t)
+    return ["G1 X%.4f Y%.4f Z%.4f A%.4f" % (a, b, a, b) for a, b in zip(x.tolist(), y.tolist())]
+
+
+def gcode_xy_regex(lines):
+    ''' regex per line implementation GcodeToGcode._parse replaced, X and Y of G1 lines only '''
+    xy_coord = re.compile(r"[xX]([-]?[0-9\.]*) [yY]([-]?[0-9\.]*)")
+    newpoints = []
+    for line in lines:
+        if line.startswith('G1'):
+            xy = xy_coord.search(line)
+            if xy is not None:
+                newpoints.append((float(xy.group(1)), float(xy.group(2))))
+    return newpoints
+
+
+def bench_gcode_parser(n=1000000):
+    lines = _fake_gcode_lines(n)
+
+    moves = dxf_parser.parse_gcode_moves(lines)
+    assert [tuple(p) for p in moves[:, :2].tolist()] == gcode_xy_regex(lines)
+
+    t_old = _best_of(lambda: gcode_xy_regex(lines), repeat=3)
+    t_new = _best_of(lambda: dxf_parser.parse_gcode_moves(lines), repeat=3)
+    print("%10s %14s %14s" % ("lines", "regex (l/s)", "parser (l/s)"))
+    print("%10d %14d %14d" % (n, n / t_old, n / t_new))
+
+
+def _fake_gcode_buffer(n, precision):
+    ''' GcodeBuffer with n 4 axis moves and a CustomGcodeFormatter writing precision decimals '''
+    t = np.linspace(0, 2 * np.pi, n)
+    gc = gcode_buffer.GcodeBuffer(units="millimeters", feedrate=300)
+    gc.moves(200 + 150 * np.cos(t), 30 + 10 * np.sin(t), 300 + 80 * np.cos(t), 35 + 6 * np.sin(t))
+    gc.gcode_formatter = gcode_formatter.CustomGcodeFormatter(gc, "X,Y,Z,A", "M3", "M5", None, precision)
+    return gc
+
+
+def gcode_writer_loop(gc):
+    ''' per row implementation CustomGcodeFormatter.iter_buffer replaced '''
+    f = gc.gcode_formatter
+    rows = zip(gc.opcode.tolist(), gc.x.tolist(), gc.y.tolist(), gc.u.tolist(), gc.v.tolist())
+    lines = f.start_commands() + [f.process_command(opcode, values) for opcode, *values in rows] + f.end_commands()
+    return "\n".join(lines)
+
+
+def bench_gcode_writer(n=1000000):
+    print("%10s %10s %14s %14s %12s" % ("lines", "precision", "loop (l/s)", "writer (l/s)", "size (MB)"))
+    for precision in (10, 4):
+        gc = _fake_gcode_buffer(n, precision)
+        assert gcode_writer_loop(gc) == gc.code_as_str
+
+        t_old = _best_of(lambda: gcode_writer_loop(gc), repeat=3)
+        t_new = _best_of(lambda: gc.code_as_str, repeat=3)
+        print("%10d %10d %14d %14d %12.1f" % (n, precision, n / t_old, n / t_new, len(gc.code_as_str) / 1e6))
+
+
+def bench_figure_transport(sizes=(2000, 20000)):
+    gplt = _plotter()
+    print("%8s %14s %14s %14s %14s" % ("points", "json (KB)", "typed (KB)", "json (ms)", "typed (ms)"))
+    for n in sizes:
+        pgc = _fake_gcode(n)
+        fig, _ = gplt.plot_gcode(pgc)
+        fig_p, _ = gplt.plot_gcode_2dprofile(pgc)
+
+        # as dash sends a figure, and as the Draw callback sends it now
+        def old():
+            return json.dumps([fig, fig_p], cls=plotly.utils.PlotlyJSONEncoder)
+
+        def new():
+            return json.dumps([plotting.encode_figure(fig), plotting.encode_figure(fig_p)], cls=plotly.utils.PlotlyJSONEncoder)
+
+        t_old, t_new = _best_of(old, repeat=3), _best_of(new, repeat=3)
+        print("%8d %14d %14d %14.1f %14.1f" % (n, len(old()) / 1024, len(new()) / 1024, t_old * 1000, t_new * 1000))
+
+
+def filter_gcode_loop(pgc, options_to_include, kind_to_include=("MOVE", "FAST_MOVE")):
+    ''' per point implementation ParsedGcode.filter_gcode replaced, on the tag names of every point '''
+    X_f, Y_f, U_f, V_f, TAG_f, KIND_f = [], [], [], [], [], []
+    for x, y, u, v, t, k in pgc.zip():
+        int_tag = set(t).intersection(options_to_include)
+        if len(int_tag) > 0 and k in kind_to_include:
+            X_f.append(x)
+            Y_f.append(y)
+            U_f.append(u)
+            V_f.append(v)
+            TAG_f.append(int_tag.pop())
+            KIND_f.append(k)
+    return plotting.ParsedGcode(X_f, Y_f, U_f, V_f, TAG_f, KIND_f)
+
+
+def bench_filter_gcode(sizes=(2000, 200000)):
+    selection = ["initial_move", "profile", "front_stock", "tail_stock"]
+    tags = ["initial_move", "profile", "done_profile", "front_stock", "tail_stock", "final"]
+    print("%8s %14s %14s %9s" % ("points", "loop (ms)", "mask (ms)", "speedup"))
+    for n in sizes:
+        pgc = _fake_gcode(n)
+        pgc = plotting.ParsedGcode(pgc.X, pgc.Y, pgc.U, pgc.V, [tags[i % len(tags)] for i in range(n)], ["MOVE"] * n)
+
+        old, new = filter_gcode_loop(pgc, selection), pgc.filter_gcode(selection)
+        for ax in ("X", "Y", "U", "V", "TAG", "KIND"):
+            assert np.array_equal(getattr(old, ax), getattr(new, ax))
+
+        t_old = _best_of(lambda: filter_gcode_loop(pgc, selection), repeat=3)
+        t_new = _best_of(lambda: pgc.filter_gcode(selection), repeat=3)
+        print("%8d %14.3f %14.3f %8.1fx" % (n, t_old * 1000, t_new * 1000, t_old / t_new))
+
+
+def bench_simulation(sizes=(1000, 100000, 1000000)):
+    gplt = _plotter()
+    target = _fake_gcode(400)
+    print("%8s %8s %14s %14s" % ("moves", "slices", "time (ms)", "moves/s"))
+    for n in sizes:
+        pgc = _fake_gcode(n)
+        for slices in (3, 9):
+            sim = simulation.CutSimulator(gplt, (1., 1.), slices=slices)
+            # the wire runs along the profile, so it melts kerf deep into it everywhere
+            assert abs(sim.simulate(pgc, target)["deviation"]["max"] + 1.) <= sim.resolution
+
+            t = _best_of(lambda: sim.simulate(pgc, target), repeat=3)
+            print("%8d %8d %14.1f %14d" % (n, slices, t * 1000, n / t))
+
+
+class _ProfileServer(http.server.ThreadingHTTPServer):
+    ''' local stand-in for a profile site: /<name> serves a profile after delay seconds, /stall never answers '''
+    daemon_threads = True
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.requests = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), _ProfileHandler)
+
+
+class _ProfileHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(60 if self.path == "/stall" else self.server.delay)
+        body = ("%s\n1.0 0.0\n0.5 0.05\n0.0 0.0\n0.5 -0.05\n1.0 0.0\n" % self.path.strip("/")).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ImmediateExecutor():
+    ''' runs every job in submit, its future is done before the caller gets it '''
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def _in_thread(fn, timeout):
+    ''' runs fn in a thread, returns whether it finished within timeout and what it returned or raised '''
+    result = []
+    def run():
+        try:
+            result.append(fn())
+        except Exception as e:
+            result.append(e)
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    t.join(timeout)
+    return not t.is_alive(), result[0] if result else None
+
+
+def bench_profile_download(clients=16, delay=0.2):
+    server = _ProfileServer(delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = "127.0.0.1:%d" % server.server_port
+    # a port nobody listens on, the download fails before fetch returns
+    probe = http.server.HTTPServer(("127.0.0.1", 0), http.server.BaseHTTPRequestHandler)
+    refused = "127.0.0.1:%d" % probe.server_port
+    probe.server_close()
+
+    path = tempfile.mkdtemp()
+    try:
+        cache = gcode_gen.ProfileCache(path, whitelist=[host, refused], timeout=0.5, read_timeout=1)
+
+        # a download that failed before fetch returns must not leave the cache locked,
+        # and is tried again on the next request
+        downloads, cache._downloads = cache._downloads, _ImmediateExecutor()
+        for i in range(2):
+            finished, error = _in_thread(lambda: cache.get_profile_filename("http://%s/refused" % refused), 5)
+            assert finished, "fetch of a refused url hangs"
+            assert isinstance(error, Exception)
+        cache._downloads = downloads
+        finished, _ = _in_thread(lambda: cache.get_profile_filename("http://%s/after" % host), 5)
+        assert finished, "the cache is locked after a failed download"
+
+        # concurrent requests for one url share a single download
+        server.requests = 0
+        url = "http://%s/coalesced" % host
+        start = time.perf_counter()
+        futures = [cache.fetch(url) for _ in range(clients)]
+        filenames = {f.result() for f in futures}
+        elapsed = time.perf_counter() - start
+        assert server.requests == 1 and len(filenames) == 1
+        assert os.path.basename(filenames.pop()) == "coalesced.dat"
+        print("%d clients, %d download in %.0f ms" % (clients, server.requests, elapsed * 1000))
+
+        # a server that never answers fails after the socket timeout
+        start = time.perf_counter()
+        finished, error = _in_thread(lambda: cache.get_profile_filename("http://%s/stall" % host), 5)
+        elapsed = time.perf_counter() - start
+        assert finished and isinstance(error, Exception)
+        print("stalled server gave up after %.0f ms (timeout %.0f ms)" % (elapsed * 1000, cache.timeout * 1000))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(path)
+
+
+BENCHMARKS = {
+    "project_coords": bench_project_coords,
+    "gcode_parser": bench_gcode_parser,
+    "gcode_writer": bench_gcode_writer,
+    "figure_transport": bench_figure_transport,
+    "filter_gcode": bench_filter_gcode,
+    "simulation": bench_simulation,
+    "profile_download": bench_profile_download,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print("== %s" % name)
+        BENCHMARKS[name]()
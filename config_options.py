@@ -1,7 +1,9 @@
 
 
 import configparser
+import functools
 from io import StringIO
+from types import MappingProxyType
 import numexpr
 import math
 
@@ -9,6 +11,117 @@ import math
 def axis_mapping(input_str):
     return len(input_str.split(","))==4
 
+
+def precision(input_str):
+    return input_str.strip().isdigit() and int(input_str) <= 10
+
+
+@functools.lru_cache(maxsize=4096)
+def evaluate_expression(expression):
+    ''' value of a numeric option like "2 * 25.4", each distinct expression is only compiled and evaluated once '''
+    return numexpr.evaluate(expression).item()
+
+
+class InvalidOption():
+    ''' stands in the snapshot for an option that is missing or does not parse, get_config raises the error '''
+    def __init__(self, error):
+        self.error = error
+
+
+CONFIG_OPTIONS = {
+        'Project':{
+                        "Units":{"type":str,"required":False,"default":"millimeters", "domain":["millimeters"]},
+                        "Name":{"type":str,"required":False,"default":""},
+        },
+        'RootChord':{   "Profile":{"type":str,"required":True},
+                        "ProfileThickness":{"type": float, "required": False, "default":0},
+                        "Width":{"type":float,"required":True},
+                        "LeadingEdgeOffset":{"type":float,"required":False,"default":0},
+                        "Rotation":{"type":float,"required":False,"default":0},
+                        "RotationPosition":{"type":float,"required":False,"default":0}
+                    },
+        'TipChord':{    "Profile":{"type":str,"required":True},
+                        "ProfileThickness":{"type": float, "required": False, "default":0},
+                        "Width":{"type":float,"required":True},
+                        "LeadingEdgeOffset":{"type":float,"required":False,"default":0},
+                        "Rotation":{"type":float,"required":False,"default":0},
+                        "RotationPosition":{"type":float,"required":False,"default":0}
+        },
+        'Panel':{
+                        "Bottom":{"type":float,"required":False, "default":0.0, "stage":"plot"},
+                        "Height":{"type":float,"required":True},
+                        "Depth":{"type":float,"required":False, "default":600.0, "stage":"plot"},
+                        "Inset":{"type":float,"required":False, "default":0.0, "stage":"plot"},
+                        "SafeHeight":{"type":float,"required":False, "default":0}
+        },
+         'Wing':{
+                        "TipChordSide":{"type":str, "required":False, "default":"right", "domain":["left","right"]},
+                        "Width":{"type":float,"required":True},
+
+                        "Inverted":{"type":bool, "required":False, "default":False},
+                        "Dihedral":{"type":float,"required":False, "default":0.0},
+                        "VerticalAlignProfiles":{"type":str,"required":False, "default": "default", "domain":["default","bottom","dihedral"]}, 
+                        "StockLeadingEdge":{"type":float,"required":False,"default":0},
+                        "StockTrailingEdge":{"type":float,"required":False,"default":0},
+                        "StockTrailingEdgeAngle":{"type":float,"required":False,"default":0},
+
+                        "SheetingTop":{"type":float,"required":False,"default":0},
+                        "SheetingBottom":{"type":float,"required":False,"default":0},                  
+        },
+        'Placement':{
+                        "RootChordOffset":{"type":float,"required":True},
+                        "HorizontalOffset":{"type":float,"required":False, "default": 0},                    
+                        "VerticalOffsetRoot":{"type":float,"required":False, "default": 25},                    
+                        "VerticalOffsetTip":{"type":float,"required":False, "default": None},                    
+                        "RotateWing":{"type":bool,"reqruied":False,"default":False}
+        },
+
+        'Machine':{
+                        "Width":{"type":float,"required":True},
+                        "Height":{"type":float,"required":False, "default": 600, "stage":"plot"},
+                        "Depth":{"type":float,"required":True, "stage":"plot"},
+
+                        "Feedrate":{"type":float,"required":True, "stage":"gcode"},
+                        "Kerf":{"type":str,"required":True},
+        },
+
+       
+        'Gcode':{
+                        "GcodeWireOn" : {"type":str,"required":False,"default":None},
+                        "GcodeWireOff" : {"type":str,"required":False,"default":None},
+                        "AxisMapping" : {"type":str,"required":False,"default":"X,Y,Z,A","validate":axis_mapping},
+                        "ConfigAsComment" : {"type":bool,"required":False,"default":True},
+                        "InterpolationPoints": {"type":int, "required":False, "default": 200, "stage":"cut"},
+                        "Precision": {"type":int, "required":False, "default": 10, "validate":precision}
+
+
+        }
+    }
+
+
+# What has to be redone after an option changes:
+#   cut   - TrailingEdgeCuttingStrategy.cut the moves again
+#   gcode - format the cut moves as gcode text again
+#   plot  - draw the figures of the cut moves again
+# each stage also depends on the options of the stages it lists
+STAGE_DEPENDENCIES = {"cut": (), "gcode": ("cut",), "plot": ("cut",)}
+# stage of the options of a section, unless the option sets its own "stage"
+SECTION_STAGES = {'Project': "gcode", 'RootChord': "cut", 'TipChord': "cut", 'Panel': "cut",
+                  'Wing': "cut", 'Placement': "cut", 'Machine': "cut", 'Gcode': "gcode"}
+
+
+def option_stage(section, parameter):
+    return CONFIG_OPTIONS[section][parameter].get("stage", SECTION_STAGES[section])
+
+
+def stage_closure(stage):
+    ''' stage and all the stages it depends on '''
+    stages = {stage}
+    for s in STAGE_DEPENDENCIES[stage]:
+        stages |= stage_closure(s)
+    return stages
+
+
 class Config():
     def __init__(self, filename = None):
     
@@ -16,91 +129,45 @@ class Config():
         self.config = configparser.ConfigParser()
         self.config.optionxform = lambda option: option
 
-        self.CONFIG_OPTIONS = {
-                'Project':{
-                                "Units":{"type":str,"required":False,"default":"millimeters", "domain":["millimeters"]},
-                                "Name":{"type":str,"required":False,"default":""},
-                },
-                'RootChord':{   "Profile":{"type":str,"required":True},
-                                "ProfileThickness":{"type": float, "required": False, "default":0},
-                                "Width":{"type":float,"required":True},
-                                "LeadingEdgeOffset":{"type":float,"required":False,"default":0},
-                                "Rotation":{"type":float,"required":False,"default":0},
-                                "RotationPosition":{"type":float,"required":False,"default":0}
-                            },
-                'TipChord':{    "Profile":{"type":str,"required":True},
-                                "ProfileThickness":{"type": float, "required": False, "default":0},
-                                "Width":{"type":float,"required":True},
-                                "LeadingEdgeOffset":{"type":float,"required":False,"default":0},
-                                "Rotation":{"type":float,"required":False,"default":0},
-                                "RotationPosition":{"type":float,"required":False,"default":0}
-                },
-                'Panel':{
-                                "Bottom":{"type":float,"required":False, "default":0.0},
-                                "Height":{"type":float,"required":True},
-                                "Depth":{"type":float,"required":False, "default":600.0},
-                                "Inset":{"type":float,"required":False, "default":0.0},
-                                "SafeHeight":{"type":float,"required":False, "default":0}
-                },
-                 'Wing':{
-                                "TipChordSide":{"type":str, "required":False, "default":"right", "domain":["left","right"]},
-                                "Width":{"type":float,"required":True},
-
-                                "Inverted":{"type":bool, "required":False, "default":False},
-                                "Dihedral":{"type":float,"required":False, "default":0.0},
-                                "VerticalAlignProfiles":{"type":str,"required":False, "default": "default", "domain":["default","bottom","dihedral"]}, 
-                                "StockLeadingEdge":{"type":float,"required":False,"default":0},
-                                "StockTrailingEdge":{"type":float,"required":False,"default":0},
-                                "StockTrailingEdgeAngle":{"type":float,"required":False,"default":0},
-
-                                "SheetingTop":{"type":float,"required":False,"default":0},
-                                "SheetingBottom":{"type":float,"required":False,"default":0},                  
-                },
-                'Placement':{
-                                "RootChordOffset":{"type":float,"required":True},
-                                "HorizontalOffset":{"type":float,"required":False, "default": 0},                    
-                                "VerticalOffsetRoot":{"type":float,"required":False, "default": 25},                    
-                                "VerticalOffsetTip":{"type":float,"required":False, "default": None},                    
-                                "RotateWing":{"type":bool,"reqruied":False,"default":False}
-                },
-
-                'Machine':{
-                                "Width":{"type":float,"required":True},
-                                "Height":{"type":float,"required":False, "default": 600},
-                                "Depth":{"type":float,"required":True},
-
-                                "Feedrate":{"type":float,"required":True},
-                                "Kerf":{"type":str,"required":True},
-                },
-
-               
-                'Gcode':{
-                                "GcodeWireOn" : {"type":str,"required":False,"default":None},
-                                "GcodeWireOff" : {"type":str,"required":False,"default":None},
-                                "AxisMapping" : {"type":str,"required":False,"default":"X,Y,Z,A","validate":axis_mapping},
-                                "ConfigAsComment" : {"type":bool,"required":False,"default":True},
-                                "InterpolationPoints": {"type":int, "required":False, "default": 200}
-
-
-                }
-            }
+        self.CONFIG_OPTIONS = CONFIG_OPTIONS
+        self.read_only = False
+        self.validation = []
+
+        self.values = self._snapshot()
 
         self.filename = filename
         if filename is not None:
             self.read_config(self.filename)
 
     def get_config(self, section, parameter):
+        v = self.values[(section, parameter)]
+        if isinstance(v, InvalidOption):
+            raise v.error
+        return v
+
+    def _snapshot(self):
+        ''' every option converted to its type once, read only '''
+        values = {}
+        for section in self.CONFIG_OPTIONS:
+            for parameter in self.CONFIG_OPTIONS[section]:
+                try:
+                    values[(section, parameter)] = self._convert(section, parameter)
+                except Exception as e:
+                    values[(section, parameter)] = InvalidOption(e)
+        return MappingProxyType(values)
+
+    def _convert(self, section, parameter):
         opt = self.CONFIG_OPTIONS[section][parameter]
         try:
             if opt['type'] == float:
                 v = self.config.get(section,parameter)
-                v = numexpr.evaluate(v).item()
+                v = evaluate_expression(v)
                 return float(v)
             elif opt['type'] == str:
                 return self.config.get(section,parameter) 
             elif opt['type'] == int:
                 v = self.config.get(section,parameter)
-                v = numexpr.evaluate(v).item()
+                v = evaluate_expression(v)
                 return int(v) 
             elif opt['type'] == bool:
                 return self.config.getboolean(section,parameter)
@@ -151,7 +218,7 @@ class Config():
                     else:
                         try:
                             if type_ in [int, float]:
-                                test = type_(numexpr.evaluate(value).item())
+                                test = type_(evaluate_expression(value))
                             else:
                                 test = type_(value)
                         except:
@@ -170,17 +237,44 @@ class Config():
 
         return result
 
+    @classmethod
+    def from_string(cls, config_string):
+        ''' a new read only Config, the validation messages are in .validation '''
+        config = cls()
+        config.validation = config.read_string(config_string)
+        config.read_only = True
+        return config
+
     def read_string(self, config_string):
+        if self.read_only:
+            raise Exception("Config is read only, use load_config to read another config")
         self.config.clear()
-        self.config.read_string(config_string)
+        try:
+            self.config.read_string(config_string)
+        finally:
+            self.values = self._snapshot()
         result = self.validate_config(config_string)
         return result
 
 
+    def stage_values(self, stage):
+        ''' (section, option, value) of every option the output of stage depends on '''
+        stages = stage_closure(stage)
+        if "gcode" in stages and self.values[('Gcode', 'ConfigAsComment')] is True:
+            # the whole config is written into the gcode as comments
+            stages = set(STAGE_DEPENDENCIES)
+        return tuple((section, parameter, value) for (section, parameter), value in self.values.items()
+                        if option_stage(section, parameter) in stages)
+
     def config_as_str(self):
         output = StringIO()
         self.config.write(output)
         contents = output.getvalue()
         output.close()  
         return contents
-        
\ No newline at end of file
+
+
+@functools.lru_cache(maxsize=64)
+def load_config(config_string):
+    ''' read only Config for config_string, the same text gives the same shared instance '''
+    return Config.from_string(config_string)
@@ -3,6 +3,8 @@ import svgpathtools
 
 
 
+import hashlib
+import itertools
 import math
 import re
 import os
@@ -77,6 +79,7 @@ class DxfToGCode:
         self.doc = doc
         self.gco_list = []
         self.gco_parsed_list = []
+        self._chain = None
         self._parse()
         
         
@@ -100,32 +103,72 @@ class DxfToGCode:
 
         self.gco_parsed_list = self.gco_list.copy()
 
-    def _reset_gco_list(self):
-        self.gco_list = self.gco_parsed_list.copy()
-
-    def find_first_xy(self):
-        self._reset_gco_list()
-        obj = self.gco_list[0]
-        while obj is not None:
-            last_point = obj.last_point()
-            obj = self.find_next(obj.last_point())
-        
-        
-        return last_point 
-                
-    def find_next(self, coord):
+    def _cell(self, p):
+        ''' spatial hash cell of a point, cells are TOL wide '''
+        return (math.floor(p[0] / self.TOL), math.floor(p[1] / self.TOL))
+
+    def _endpoint_index(self):
+        ''' maps the cell of every end point to the objects that end there, in document order '''
+        index = {}
+        for i, obj in enumerate(self.gco_parsed_list):
+            for p in (obj.first_point(), obj.last_point()):
+                index.setdefault(self._cell(p), []).append(i)
+        return index
+
+    def chain(self):
+        ''' coordinates of all the objects joined end to end, computed once per document '''
+        if self._chain is None:
+            self._chain = self._build_chain()
+        return self._chain
+
+    def _build_chain(self):
         def dist(t1,t2):
             return math.sqrt((t1[0]-t2[0])**2 + (t1[1] - t2[1]) **2)
-        
-        for i,obj in enumerate(self.gco_list):
-            if dist(obj.first_point(), coord) < self.TOL:
-                del self.gco_list[i]
-                return obj
-            if dist(obj.last_point(), coord)  < self.TOL:
-                del self.gco_list[i]
-                obj.reverse()
-                return obj
-        return None
+
+        objs = self.gco_parsed_list
+        index = self._endpoint_index()
+        flipped = [False] * len(objs)
+
+        def ends(i):
+            first, last = objs[i].first_point(), objs[i].last_point()
+            return (last, first) if flipped[i] else (first, last)
+
+        def find_next(coord, used):
+            # first unused object in document order with an end point within TOL of coord,
+            # turned around if needed so it starts at coord
+            cx, cy = self._cell(coord)
+            candidates = set()
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    candidates.update(index.get((cx + dx, cy + dy), ()))
+            for i in sorted(candidates - used):
+                first, last = ends(i)
+                if dist(first, coord) < self.TOL or dist(last, coord) < self.TOL:
+                    used.add(i)
+                    if dist(first, coord) >= self.TOL:
+                        flipped[i] = not flipped[i]
+                    return i
+            return None
+
+        # follow the chain from the first object to find an end to start from
+        used = set()
+        start = ends(0)[1]
+        i = find_next(start, used)
+        while i is not None:
+            start = ends(i)[1]
+            i = find_next(start, used)
+
+        coord_list = []
+        used = set()
+        i = find_next(start, used)
+        while i is not None:
+            points = []
+            objs[i].to_gcode(points)
+            if flipped[i]:
+                points.reverse()
+            coord_list.extend(points)
+            i = find_next(ends(i)[1], used)
+        return coord_list
     
     
     def to_gcode(self,x_offset, y_offset, rotate_angle, scale_factor, four_axis, feedrate = 160, pwm = 100):
@@ -144,38 +187,29 @@ class DxfToGCode:
         return gcode_list 
 
     def to_xy_array(self, x_offset, y_offset, rotate_angle, scale_factor, ignore_offset=False, add_zero=True):
-        start_x,start_y =  self.find_first_xy()
-
-        self._reset_gco_list()
-        obj =  self.find_next((start_x,start_y))
-                
-        coord_list = []
-        while obj is not None:
-            obj.to_gcode(coord_list)
-            obj = self.find_next(obj.last_point())  
+        coords = np.asarray(self.chain(), dtype=np.double)
 
         if not ignore_offset:
-            coord_list = [(x * scale_factor,y * scale_factor) for x,y in coord_list  ]
-            coord_list = rotate(coord_list, degrees = rotate_angle)
+            # scale and rotate about the origin in one go
+            coords = np.atleast_2d(rotate(coords * scale_factor, degrees = rotate_angle))
         else:
             scale_factor = 1.
             rotate_angle = 0.
 
-        min_x = min([x for x,y in coord_list])
-        min_y = min([y for x,y in coord_list])
+        min_x, min_y = coords.min(axis=0).tolist()
 
 
         if ignore_offset:
             x_offset = min_x  
             y_offset = min_y 
 
-        x_series = [x+x_offset-min_x for x,y in coord_list]
+        x_series = (coords[:,0] + x_offset - min_x).tolist()
         x_series.append(x_series[0])
         if add_zero:
             x_series.insert(0,0)
             x_series.append(0)
 
-        y_series  = [y+y_offset-min_y for x, y in coord_list]
+        y_series = (coords[:,1] + y_offset - min_y).tolist()
         y_series.append(y_series[0])
         if add_zero:
             y_series.insert(0,0)
@@ -269,9 +303,96 @@ class DxfToGCode:
 
 
 
+GCODE_AXES = {'X': 0, 'Y': 1, 'Z': 2, 'U': 2, 'A': 3, 'V': 3}
+# G codes with axis words that are not a move: dwell, offsets, home and set position
+GCODE_NOT_A_MOVE = (4, 10, 28, 30, 92)
+
+_GCODE_COMMENT = re.compile(r";[^\n]*|\([^)\n]*\)?")
+# character classes of the ascii bytes
+_IS_LETTER = np.zeros(256, bool)
+_IS_LETTER[ord('A'):ord('Z') + 1] = True
+_IS_NUM = np.zeros(256, bool)
+_IS_NUM[[ord(c) for c in "0123456789.-+"]] = True
+_IS_BLANK = np.zeros(256, bool)
+_IS_BLANK[[ord(' '), ord('\t')]] = True
+
+
+def parse_gcode_moves(lines, axes=GCODE_AXES, chunk_lines=10000):
+    ''' position after every G0/G1 move in lines (any iterable of strings, read once) as an
+        (n, 4) array of X, Y, Z/U, A/V. Axes a move leaves out keep their previous value and lines with
+        only coordinates continue the last G0/G1, comments and lower case words are accepted.
+        The lines are tokenized a chunk at a time with numpy instead of word by word '''
+    position = np.zeros(4)
+    mode = 0.
+    moves = []
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_lines))
+        if not chunk:
+            break
+        text = "\n".join(chunk).upper()
+        if ';' in text or '(' in text:
+            text = _GCODE_COMMENT.sub("", text)
+        b = np.frombuffer(text.encode('ascii', 'replace'), np.uint8)
+
+        # drop blanks between a letter and its number, "X 1.5" is read as "X1.5"
+        is_letter = _IS_LETTER[b]
+        is_blank = _IS_BLANK[b]
+        if (is_letter[:-1] & is_blank[1:]).any():
+            last_char = np.maximum.accumulate(np.where(is_blank, 0, np.arange(len(b))))
+            keep = ~(is_blank & is_letter[last_char])
+            b, is_letter = b[keep], is_letter[keep]
+
+        # a word is a letter directly followed by a number, anything else is ignored
+        is_num = _IS_NUM[b]
+        is_word = is_letter & np.concatenate((is_num[1:], [False]))
+        num_start = is_num & ~np.concatenate(([False], is_num[:-1]))
+        stray = num_start & ~np.concatenate(([False], is_word[:-1]))
+        if stray.any():
+            run = np.cumsum(num_start)
+            is_num &= ~np.isin(run, run[stray])
+
+        at = np.flatnonzero(is_word)
+        letters = b[at]
+        newlines = np.flatnonzero(b == ord('\n'))
+        line = np.searchsorted(newlines, at)
+        n_lines = len(newlines) + 1
+        values = np.zeros(0)
+        if len(at):
+            values = np.fromstring(np.where(is_num, b, ord(' ')).astype(np.uint8).tobytes(), sep=' ')
+        if len(values) != len(letters):
+            raise Exception("Malformed number in gcode")
+
+        cols = np.full((n_lines, 4), np.nan)
+        for letter, col in axes.items():
+            sel = letters == ord(letter)
+            cols[line[sel], col] = values[sel]
+
+        # 1 for G0/G1, 0 for arcs which are not followed, nan where the line does not set it
+        g = letters == ord('G')
+        g_line, g_code = line[g], values[g]
+        line_mode = np.full(n_lines, np.nan)
+        motion = g_code < 4
+        line_mode[g_line[motion]] = g_code[motion] < 2
+        not_a_move = np.zeros(n_lines, bool)
+        not_a_move[g_line[np.isin(g_code, GCODE_NOT_A_MOVE)]] = True
+
+        moved = ~np.all(np.isnan(cols), axis=1)
+        line_mode = utils.ffill(line_mode, mode)
+        for col in range(4):
+            cols[:, col] = utils.ffill(cols[:, col], position[col])
+
+        position = cols[-1]
+        mode = line_mode[-1]
+        moves.append(cols[moved & (line_mode == 1) & ~not_a_move])
+
+    return np.concatenate(moves) if moves else np.zeros((0, 4))
+
+
 class GcodeToGcode(DxfToGCode):
-    def __init__(self, gcode_lines):
+    def __init__(self, gcode_lines, axes=('X', 'Y')):
         self.gcode_lines = gcode_lines
+        self.axes = axes
         DxfToGCode.__init__(self, None)
         
 
@@ -279,19 +400,11 @@ class GcodeToGcode(DxfToGCode):
     def _parse(self):
         self.gco_list = []
 
-        xy_coord = re.compile(r"[xX]([-]?[0-9\.]*) [yY]([-]?[0-9\.]*)")
-        
-        newpoints = []
-        for line in self.gcode_lines:
-            if line.startswith('G1'):
-                xy = xy_coord.search(line)
-                if xy is not None:
-                    x = float(xy.group(1))
-                    y = float(xy.group(2))
-                    newpoints.append((x,y))
-
-        del newpoints[0]
-        del newpoints[-1]
+        cols = [GCODE_AXES[a.upper()] for a in self.axes]
+        moves = parse_gcode_moves(self.gcode_lines)
+
+        # the first and last moves are the lead in and out from the origin
+        newpoints = [tuple(p) for p in moves[1:-1, cols].tolist()]
         self.gco_list.append(LWPolyLine(newpoints))
 
         self.gco_parsed_list = self.gco_list.copy()
@@ -299,29 +412,102 @@ class GcodeToGcode(DxfToGCode):
 
 
 class SVGToGcode(DxfToGCode):
-    def __init__(self, paths):
+    TOLERANCE = 0.01
+    def __init__(self, paths, tolerance=None):
         self.paths = paths
+        self.tolerance = self.check_tolerance(tolerance)
         DxfToGCode.__init__(self, None)
 
+    @classmethod
+    def check_tolerance(cls, tolerance):
+        ''' the chord tolerance to flatten with, TOLERANCE if tolerance is None '''
+        if tolerance is None:
+            return cls.TOLERANCE
+        if not tolerance > 0:
+            raise ValueError("The tolerance must be larger than 0, got %r" % tolerance)
+        return tolerance
+
     def _parse(self):
         self.gco_list = []
 
     
         for path in self.paths:
+            if len(path) == 0:
+                continue
             newpoints = []
             for segment in path:
-                for i in np.arange(0,1,0.05):
-                    c = segment.point(i)
-                    x,y = c.real,c.imag
-                    newpoints.append((x,y))
+                newpoints.extend(self.flatten(segment))
+            if not path.isclosed():
+                newpoints.append((path.end.real, path.end.imag))
             self.gco_list.append(LWPolyLine(newpoints))
         
 
         self.gco_parsed_list = self.gco_list.copy()
 
+    def flatten(self, segment):
+        ''' points from the start of segment up to, not including, its end. 
+            As few as needed to keep the chords within tolerance of the curve '''
+        if isinstance(segment, svgpathtools.Line):
+            return [(segment.start.real, segment.start.imag)]
+
+        if isinstance(segment, (svgpathtools.QuadraticBezier, svgpathtools.CubicBezier)):
+            p = np.array(segment.bpoints())
+            degree = len(p) - 1
+            # Wang's formula: the chord error is at most max|B''| / (8 n^2)
+            max_d2 = degree * (degree - 1) * np.max(np.abs(p[:-2] - 2 * p[1:-1] + p[2:]))
+            n = max(1, int(np.ceil(np.sqrt(max_d2 / (8 * self.tolerance)))))
+            t = np.arange(n)[:, None] / n
+            k = np.arange(degree + 1)
+            binom = np.array([math.comb(degree, i) for i in k])
+            points = (binom * (1 - t) ** (degree - k) * t ** k) @ p
+        elif isinstance(segment, svgpathtools.Arc):
+            r = max(abs(segment.radius.real), abs(segment.radius.imag))
+            # angle step that keeps the sagitta r(1-cos(step/2)) within tolerance
+            step = 2 * np.arccos(max(1 - self.tolerance / r, -1)) if r > 0 else np.pi
+            n = max(1, int(np.ceil(abs(np.deg2rad(segment.delta)) / step)))
+            points = np.array([segment.point(t) for t in np.arange(n) / n])
+        else:
+            points = np.array([segment.point(t) for t in np.arange(0,1,0.05)])
+
+        return list(zip(points.real.tolist(), points.imag.tolist()))
+
+
+
+class ChainedCoordinates(DxfToGCode):
+    ''' an already chained, unscaled coordinate array, as cached by load_parser '''
+    def __init__(self, coords):
+        self.coords = coords
+        DxfToGCode.__init__(self, None)
+
+    def _parse(self):
+        self._chain = self.coords
+
+
+def file_key(stored_filename):
+    ''' content hash of an uploaded file, the extension is part of the key as it selects the parser '''
+    h = hashlib.sha256()
+    with open(stored_filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    _,extension =  os.path.splitext(stored_filename)
+    return h.hexdigest() + extension.lower()
+
+
+def load_parser(stored_filename, cache=None, tolerance=None):
+    ''' like create_parser, but only the chained coordinates are kept, in cache (a ResultCache)
+        keyed on the file contents, so changing offset, rotation or scale does not parse the file again '''
+    if cache is None:
+        return create_parser(stored_filename, tolerance)
+
+    key = file_key(stored_filename)
+    if key.endswith('.svg'):
+        key += ":%r" % SVGToGcode.check_tolerance(tolerance)
+    coords = cache.get_or_create(key,
+                lambda: np.asarray(create_parser(stored_filename, tolerance).chain(), dtype=np.double))
+    return ChainedCoordinates(coords)
 
 
-def create_parser(stored_filename):
+def create_parser(stored_filename, tolerance=None):
         _,extension =  os.path.splitext(stored_filename)
         extension = extension.lower()
 
@@ -331,11 +517,10 @@ def create_parser(stored_filename):
 
         elif extension == '.svg':
             paths,_ = svgpathtools.svg2paths(stored_filename)
-            dxfp = SVGToGcode(paths)
+            dxfp = SVGToGcode(paths, tolerance)
         elif extension == '.gcode':
             with open(stored_filename) as f:
-                lines = f.readlines()
-            dxfp = GcodeToGcode(lines)
+                dxfp = GcodeToGcode(f)
         else:
             raise Exception("Unsupported filetype")
 
@@ -0,0 +1,197 @@
+from __future__ import division
+from hotwing_core.gcode import DEFAULT_FEEDRATE_IN, DEFAULT_FEEDRATE_MM
+import numpy as np
+
+
+# opcodes stored in the opcode column
+MOVE = 0
+FAST_MOVE = 1
+DWELL = 2
+COMMAND_TYPES = ("MOVE", "FAST_MOVE", "DWELL")
+
+# every tag used by the cutting strategy gets one bit in the tag column
+TAGS = ("initial_move", "profile", "done_profile", "front_stock", "tail_stock", "final", "do_not_normalize")
+TAG_BITS = {t: 1 << i for i, t in enumerate(TAGS)}
+
+AXES = ('x', 'y', 'u', 'v')
+
+
+def tag_mask(options):
+    ''' bitmask for a list of tags '''
+    mask = 0
+    for o in options:
+        try:
+            mask |= TAG_BITS[o]
+        except KeyError:
+            raise ValueError(f"Unknown gcode tag:{o}")
+    return mask
+
+
+def tag_names(mask):
+    ''' list of tags set in a bitmask '''
+    return [t for t in TAGS if mask & TAG_BITS[t]]
+
+
+class GcodeBuffer():
+    """
+    Columnar replacement for hotwing_core's Gcode command list.
+
+    Every command is a row in contiguous arrays: x/y/u/v (float64, NaN for an axis the command
+    does not move), a small int opcode and a tag bitmask.  Dwell rows keep their time in the x column.
+    Exposes the same move/fast_move/dwell/normalize/code_as_str interface as Gcode, plus
+    moves() to append a whole array of cuts at once.
+    """
+
+    def __init__(self, units="inches", feedrate=None, capacity=1024):
+        self.units = units
+        if feedrate:
+            self.feedrate = feedrate
+        else:
+            # feedrate not specified, set to default
+            self.feedrate = DEFAULT_FEEDRATE_IN if units=="inches" else DEFAULT_FEEDRATE_MM
+
+        self.gcode_formatter = None
+        self._n = 0
+        self._coords = np.empty((capacity, 4), np.float64)
+        self._opcode = np.empty(capacity, np.uint8)
+        self._tags = np.empty(capacity, np.uint16)
+
+    def with_header(self, units, feedrate):
+        """
+        a GcodeBuffer sharing the commands of this one, with other units and feedrate
+        """
+        gc = GcodeBuffer(units, feedrate, capacity=1)
+        gc._n, gc._coords, gc._opcode, gc._tags = self._n, self._coords, self._opcode, self._tags
+        return gc
+
+    def __len__(self):
+        return self._n
+
+    def _reserve(self, count):
+        needed = self._n + count
+        capacity = len(self._opcode)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self._coords = np.resize(self._coords, (capacity, 4))
+        self._opcode = np.resize(self._opcode, capacity)
+        self._tags = np.resize(self._tags, capacity)
+
+    def _append(self, opcode, coords, options):
+        self._reserve(1)
+        row = self._coords[self._n]
+        for i, ax in enumerate(AXES):
+            row[i] = coords.get(ax, np.nan)
+        self._opcode[self._n] = opcode
+        self._tags[self._n] = tag_mask(options)
+        self._n += 1
+
+    def move(self, coords, options=[]):
+        self._append(MOVE, coords, options)
+
+    def fast_move(self, coords, options=[]):
+        self._append(FAST_MOVE, coords, options)
+
+    def dwell(self, time, options=[]):
+        """
+        time in seconds
+        """
+        self._append(DWELL, {'x':time}, options)
+
+    def moves(self, x, y, u, v, options=[]):
+        ''' append one MOVE per element of the x, y, u, v arrays '''
+        count = len(x)
+        self._reserve(count)
+        rows = slice(self._n, self._n + count)
+        for i, col in enumerate((x, y, u, v)):
+            self._coords[rows, i] = col
+        self._opcode[rows] = MOVE
+        self._tags[rows] = tag_mask(options)
+        self._n += count
+
+    @property
+    def x(self):
+        return self._coords[:self._n, 0]
+
+    @property
+    def y(self):
+        return self._coords[:self._n, 1]
+
+    @property
+    def u(self):
+        return self._coords[:self._n, 2]
+
+    @property
+    def v(self):
+        return self._coords[:self._n, 3]
+
+    @property
+    def opcode(self):
+        return self._opcode[:self._n]
+
+    @property
+    def tags(self):
+        return self._tags[:self._n]
+
+    def is_move(self):
+        ''' boolean mask of MOVE and FAST_MOVE rows '''
+        return self.opcode != DWELL
+
+    def normalize(self):
+        """
+        go through the code and offset it so that min values are 0,
+        returns the (x, y) offset taken off
+        """
+        moves = self.is_move() & (self.tags & TAG_BITS["do_not_normalize"] == 0)
+        c = self._coords[:self._n][moves]
+
+        min_x = min(np.nanmin(c[:, 0]), np.nanmin(c[:, 2]))
+        min_y = min(np.nanmin(c[:, 1]), np.nanmin(c[:, 3]))
+
+        offset_y = min_y if min_y < 0 else 0
+        offset_x = min_x if min_x < 0 else 0
+
+        # NaN axes stay NaN
+        c -= np.array([offset_x, offset_y, offset_x, offset_y])
+        self._coords[:self._n][moves] = c
+        return offset_x, offset_y
+
+    @property
+    def code(self):
+        """
+        returns the gcode as a list
+        """
+        output = []
+        output += self.gcode_formatter.start_commands()
+        output += self.gcode_formatter.process_buffer(self)
+        output += self.gcode_formatter.end_commands()
+        return output
+
+    @property
+    def code_as_str(self):
+        return "".join(self.iter_code())
+
+    def iter_code(self, chunk_rows=10000):
+        """
+        yields the gcode in pieces of up to chunk_rows lines, joined they are code_as_str
+        """
+        formatter = self.gcode_formatter
+        blocks = [["\n".join(formatter.start_commands())], formatter.iter_buffer(self, chunk_rows),
+                  ["\n".join(formatter.end_commands())]]
+        sep = ""
+        for block in blocks:
+            for text in block:
+                yield sep + text
+                sep = "\n"
+
+    def write_code(self, f, chunk_rows=10000):
+        """
+        streams the gcode to the file-like object f without building it in memory,
+        returns the number of lines written
+        """
+        lines = 1
+        for text in self.iter_code(chunk_rows):
+            f.write(text)
+            lines += text.count("\n")
+        return lines
@@ -1,51 +1,92 @@
 from __future__ import division
 from hotwing_core.gcode_formatters.base import GcodeFormatterBase
+import gcode_buffer
+import numpy as np
 import logging
 logging.getLogger(__name__)
 
 class CustomGcodeFormatter(GcodeFormatterBase):
 
-    def __init__(self, parent, axis_mapping, hotwire_on, hotwire_off, prepend):
+    def __init__(self, parent, axis_mapping, hotwire_on, hotwire_off, prepend, precision=10):
         super().__init__(parent)
         self.axis_mapping = {f:to for (f,to) in zip(['x','y','u','v'],axis_mapping.split(","))}
         self.hotwire_on = hotwire_on
         self.hotwire_off = hotwire_off
         self.prepend = prepend
-
-
-    def process_command(self, command):
-        c = command.data
-        if command.type_ == "MOVE":
-            return self.process_move(command)
-        elif command.type_ == "FAST_MOVE":
-            return self.process_fast_move(command)
-        elif command.type_ == "DWELL":
-            return self.process_dwell(command)
+        # decimals written per axis value
+        self.precision = precision
+        self._row_formats = {}
+
+
+    def process_buffer(self, buffer):
+        ''' format every row of a GcodeBuffer, reading straight from its columns '''
+        return [line for block in self.iter_buffer(buffer) for line in block.split("\n")]
+
+    def _row_format(self, opcode, axes):
+        ''' %-format of a row with the given opcode, axes is a bitmask of the axes the row moves '''
+        key = (opcode, axes)
+        fmt = self._row_formats.get(key)
+        if fmt is None:
+            if opcode == gcode_buffer.MOVE or opcode == gcode_buffer.FAST_MOVE:
+                cmd_list = ['G1' if opcode == gcode_buffer.MOVE else 'G0']
+                for i, ax in enumerate(['x','y','u','v']):
+                    if axes & (1 << i):
+                        cmd_list.append("%s%%.%df" % (self.axis_mapping[ax].replace("%", "%%"), self.precision))
+                fmt = " ".join(cmd_list)
+            elif opcode == gcode_buffer.DWELL:
+                fmt = "G4 P%.4f"
+            else:
+                fmt = self.process_command(opcode, []).replace("%", "%%")
+            self._row_formats[key] = fmt
+        return fmt
+
+    def iter_buffer(self, buffer, chunk_rows=10000):
+        ''' formats the rows of a GcodeBuffer chunk_rows at a time, yields each chunk as one string of lines.
+            All the rows of a chunk are formatted by a single % of their joined row formats '''
+        for start in range(0, len(buffer), chunk_rows):
+            rows = slice(start, start + chunk_rows)
+            opcode = buffer.opcode[rows]
+            coords = np.column_stack((buffer.x[rows], buffer.y[rows], buffer.u[rows], buffer.v[rows]))
+            moved = ~np.isnan(coords)
+            moved[(opcode != gcode_buffer.MOVE) & (opcode != gcode_buffer.FAST_MOVE)] = False
+            # dwell rows only use their time, in the x column
+            moved[opcode == gcode_buffer.DWELL, 0] = True
+            axes = moved @ np.array([1, 2, 4, 8])
+
+            if (opcode == opcode[0]).all() and (axes == axes[0]).all():
+                # the usual chunk of full 4 axis moves
+                formats = [self._row_format(int(opcode[0]), int(axes[0]))] * len(opcode)
+            else:
+                formats = [self._row_format(o, a) for o, a in zip(opcode.tolist(), axes.tolist())]
+            yield "\n".join(formats) % tuple(coords[moved].tolist())
+
+    def process_command(self, opcode, values):
+        if opcode == gcode_buffer.MOVE:
+            return self.process_move(values)
+        elif opcode == gcode_buffer.FAST_MOVE:
+            return self.process_fast_move(values)
+        elif opcode == gcode_buffer.DWELL:
+            return self.process_dwell(values)
         else:
-            self._log_unrecognized_command(command)
+            logging.warning("GCODE FORMATTER RECEIVED UNKNOWN OPCODE '%s'" % opcode)
             return ""
 
-    def process_dwell(self, command):
-        return "G4 P%.4f" % command.data['p']
+    def process_dwell(self, values):
+        return "G4 P%.4f" % values[0]
 
-    def process_move(self,command):
-        d = command.data
+    def _process_axes(self, cmd_list, values):
         am = self.axis_mapping
-
-        cmd_list = ['G1']
-        for ax in ['x','y','u','v']:
-            if ax in d:
-                cmd_list.append("%s%.10f" % (am[ax],d[ax]))
+        for ax, value in zip(['x','y','u','v'], values):
+            # NaN marks an axis the command does not move
+            if value == value:
+                cmd_list.append("%s%.*f" % (am[ax], self.precision, value))
         return " ".join(cmd_list)
 
-    def process_fast_move(self, command):
-        d = command.data
-        am = self.axis_mapping 
-        cmd_list = ['G0']
-        for ax in ['x','y','u','v']:
-            if ax in d:
-                cmd_list.append("%s%.10f" % (am[ax],d[ax]))
-        return " ".join(cmd_list)
+    def process_move(self, values):
+        return self._process_axes(['G1'], values)
+
+    def process_fast_move(self, values):
+        return self._process_axes(['G0'], values)
 
     def start_commands(self):
         out = []
@@ -4,19 +4,27 @@ from hotwing_core.rib import Rib
 from hotwing_core.machine import Machine
 from hotwing_core.panel import Panel
 from hotwing_core.coordinate import Coordinate
-from hotwing_core.gcode import Gcode
+from hotwing_core.surface import Surface
 import datetime
+from functools import cached_property
 from importlib import reload
 
 import trailing_cutting_strategy
 reload(trailing_cutting_strategy)
 import config_options
 import gcode_formatter
+import gcode_buffer
 import os
 
 import ssl
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import numpy as np
 import urllib.request
 import json
+import sqlite3
 from urllib.parse import urlparse
 import utils
 
@@ -33,7 +41,7 @@ def validate_kerf(kerf):
 
 class ProfileCache():
     
-    def __init__(self, path):
+    def __init__(self, path, whitelist=None, timeout=10, read_timeout=30, max_downloads=4):
         self.cache = {}
 
         if not os.path.isdir(path):
@@ -41,23 +49,71 @@ class ProfileCache():
 
         self.path = path
 
+        # parsed profiles: in memory keyed on (filename, mtime, size), on disk as .npz keyed on content hash
+        self.parsed = {}
+        self.parsed_path = os.path.join(path, "parsed")
+        if not os.path.isdir(self.parsed_path):
+            os.mkdir(self.parsed_path)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # downloads: timeout bounds connecting and every socket read, read_timeout the whole download
+        self.timeout = timeout
+        self.read_timeout = read_timeout
+        self._downloads = ThreadPoolExecutor(max_workers=max_downloads, thread_name_prefix="profile-download")
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        # url -> filename index in sqlite, shared by all worker processes
+        self.index_filename = os.path.join(path, "cache.sqlite")
+        self._local = threading.local()
+
         self.load()
 
-        with open("profile_whitelist") as f:
-            self.WHITELIST = [l.strip().lower() for l in f.readlines()]
+        if whitelist is None:
+            with open("profile_whitelist") as f:
+                whitelist = f.readlines()
+        self.WHITELIST = [l.strip().lower() for l in whitelist]
+
 
 
+    def _db(self):
+        ''' sqlite connection to the index shared by all workers, one per thread and process '''
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.index_filename, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS profiles (url TEXT PRIMARY KEY, filename TEXT NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
 
     def load(self):
+        # import the cache.json index written by older versions
         try:
             with open(self.path + "/cache.json") as f:
-                self.cache = json.load(f)
+                entries = json.load(f)
         except:
-            self.cache = {}
-
-    def save(self):
-        with open(self.path + "/cache.json", "w") as f:
-            json.dump(self.cache, f)
+            entries = {}
+
+        with self._db() as conn:
+            conn.executemany("INSERT OR IGNORE INTO profiles (url, filename) VALUES (?, ?)", entries.items())
+
+    def lookup(self, url):
+        ''' local filename of a downloaded url or None.  Looks in memory first, then in the shared
+            index, so downloads by other workers are visible straight away'''
+        filename = self.cache.get(url, None)
+        if filename is None:
+            row = self._db().execute("SELECT filename FROM profiles WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                filename = self.cache[url] = row[0]
+        return filename
+
+    def add(self, url, filename):
+        with self._db() as conn:
+            conn.execute("INSERT OR REPLACE INTO profiles (url, filename) VALUES (?, ?)", (url, filename))
+        self.cache[url] = filename
 
     def is_url(self, url):
         if url.strip().lower().startswith("http"):
@@ -68,59 +124,155 @@ class ProfileCache():
 
     def get_profile_filename(self, url):
         if self.is_url(url):
-
-            filename = self.cache.get(url, None)
-            if filename is None:
-                parsed_url = urlparse(url)
-                if parsed_url.netloc.lower() in self.WHITELIST:
-                    gcontext = ssl.SSLContext()
-                    try:
-                        req = urllib.request.Request(url)
-                        res = urllib.request.urlopen(req, context=gcontext)
-                        contents = res.read().decode('utf-8')
-                    except Exception:
-                        raise Exception(f"Could not open url:{url}")
-
-                    lines = contents.split("\n")
-                    profile_name = utils.removeDisallowedFilenameChars(lines[0].strip())
-
-                    filename = f"{self.path}/{profile_name}.dat"
-                    with open(filename,"w") as f:
-                        f.write(contents)
-
-                    self.cache[url] = filename
-                    self.save()
-                else:
-                    raise Exception("%s not in whitelist" % parsed_url.netloc)
-
-            return filename
+            return self.fetch(url).result()
 
         else:
             # not a url, so assume it is a filename
             return url
 
+    def prefetch(self, urls):
+        ''' Starts downloading all urls in parallel, get_profile_filename then waits for the download '''
+        for url in urls:
+            if self.is_url(url):
+                self.fetch(url)
+
+    def fetch(self, url):
+        ''' Returns a Future with the local filename for url.
+            Requests for a url that is already downloading share the same download'''
+        with self._lock:
+            filename = self.lookup(url)
+            if filename is not None:
+                future = Future()
+                future.set_result(filename)
+                return future
+
+            parsed_url = urlparse(url)
+            if parsed_url.netloc.lower() not in self.WHITELIST:
+                raise Exception("%s not in whitelist" % parsed_url.netloc)
+
+            future = self._inflight.get(url, None)
+            if future is not None:
+                return future
+            future = self._downloads.submit(self._download, url)
+            self._inflight[url] = future
+
+        # outside the lock, a download that already failed runs the callback right here
+        future.add_done_callback(lambda f: self._download_done(url, f))
+        return future
+
+    def _download_done(self, url, future):
+        with self._lock:
+            if self._inflight.get(url, None) is future:
+                del self._inflight[url]
+
+    def _download(self, url):
+        gcontext = ssl.SSLContext()
+        try:
+            req = urllib.request.Request(url)
+            deadline = time.monotonic() + self.read_timeout
+            chunks = []
+            with urllib.request.urlopen(req, context=gcontext, timeout=self.timeout) as res:
+                while True:
+                    chunk = res.read(64 * 1024)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    if time.monotonic() > deadline:
+                        raise TimeoutError("read timeout")
+            contents = b"".join(chunks).decode('utf-8')
+        except Exception:
+            raise Exception(f"Could not open url:{url}")
+
+        lines = contents.split("\n")
+        profile_name = utils.removeDisallowedFilenameChars(lines[0].strip())
+
+        filename = f"{self.path}/{profile_name}.dat"
+        tmp_filename = utils.get_temp_filename(self.path)
+        with open(tmp_filename,"w") as f:
+            f.write(contents)
+        os.replace(tmp_filename, filename)
+
+        with self._lock:
+            self.add(url, filename)
+
+        return filename
+
+    def get_profile(self, url):
+        ''' Returns a new Profile for the url or filename.  Only the first request for a file parses it,
+            after that the top and bottom coordinates come from memory or from the .npz store'''
+        filename = self.get_profile_filename(url)
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+        arrays = self.parsed.get(key, None)
+        if arrays is not None:
+            self.hits += 1
+        else:
+            with open(filename, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            npz_filename = os.path.join(self.parsed_path, digest + ".npz")
+
+            if os.path.exists(npz_filename):
+                with np.load(npz_filename) as npz:
+                    arrays = (npz['top'], npz['bottom'])
+                self.disk_hits += 1
+            else:
+                profile = Profile(filename)
+                arrays = (np.array([(c.x, c.y) for c in profile.top.coordinates], float),
+                          np.array([(c.x, c.y) for c in profile.bottom.coordinates], float))
+                self._save_parsed(npz_filename, arrays)
+                self.misses += 1
+
+            self.parsed[key] = arrays
+
+        top, bottom = arrays
+        return Profile(Surface([Coordinate(x, y) for x, y in top.tolist()]),
+                       Surface([Coordinate(x, y) for x, y in bottom.tolist()]))
+
+    def _save_parsed(self, npz_filename, arrays):
+        # write to a temp file first, so other workers never load a half written file
+        tmp_filename = utils.get_temp_filename(self.parsed_path)
+        with open(tmp_filename, "wb") as f:
+            np.savez(f, top=arrays[0], bottom=arrays[1])
+        os.replace(tmp_filename, npz_filename)
+
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'profiles': len(self.parsed)}
+
             
 
 
 
+class PreparedRib(Rib):
+    ''' Rib that scales, rotates and sheets its profile only once, so several cuts can share it '''
+
+    @cached_property
+    def profile(self):
+        return Rib.profile.fget(self)
+
+
 class GcodeGen():
 
     def __init__(self, config, profile_cache : ProfileCache):
         self.config = config
         self.points = self.config.get_config('Gcode','InterpolationPoints')
         self.pcache = profile_cache
+        self.ribs = None
+
+    def load_ribs(self):
+        ''' Loads the root and tip profiles, only the first call reads the profile files '''
+        if self.ribs is not None:
+            return self.ribs
 
-    def gen_gcode(self):
         get_config = self.config.get_config
-        root_offset =  get_config('Placement','RootChordOffset')
-        side = get_config('Wing','TipChordSide')
-        root_profile_thickness = get_config('RootChord','ProfileThickness')
-        tip_profile_thickness = get_config('TipChord', 'ProfileThickness')
 
-        root_profile_filename = self.pcache.get_profile_filename(get_config('RootChord',"Profile"))
+        # download root and tip in parallel
+        self.pcache.prefetch([get_config('RootChord',"Profile"), get_config('TipChord',"Profile")])
 
+        root_profile = self.pcache.get_profile(get_config('RootChord',"Profile"))
 
-        rib1 = Rib( root_profile_filename, 
+
+        rib1 = PreparedRib( root_profile, 
                             scale=get_config('RootChord',"Width"), 
                             xy_offset=Coordinate(get_config('RootChord',"LeadingEdgeOffset"),0), 
                             top_sheet=get_config('Wing',"SheetingTop"), 
@@ -131,9 +283,9 @@ class GcodeGen():
                             rotation_pos=get_config('RootChord',"RotationPosition"),
                             )
 
-        tip_profile_filename = self.pcache.get_profile_filename(get_config('TipChord',"Profile"))
+        tip_profile = self.pcache.get_profile(get_config('TipChord',"Profile"))
 
-        rib2 = Rib( tip_profile_filename,
+        rib2 = PreparedRib( tip_profile,
                             scale=get_config('TipChord',"Width"), 
                             xy_offset=Coordinate(get_config('TipChord',"LeadingEdgeOffset"),0), 
                             top_sheet=get_config('Wing',"SheetingTop"), 
@@ -144,8 +296,23 @@ class GcodeGen():
                             rotation_pos=get_config('TipChord',"RotationPosition"),
                             )
 
+        self.ribs = (rib1, rib2)
+        return self.ribs
+
+    def gen_gcode(self, kerf=None, with_target=False):
+        ''' Generates the gcode, kerf (same format as [Machine] Kerf) overrides the configured kerf.
+            The profiles are loaded once per GcodeGen, so repeated calls only redo the kerf offset and the cut.
+            with_target also sets target and rib_planes, the profiles without kerf a simulation measures against'''
+        get_config = self.config.get_config
+        root_offset =  get_config('Placement','RootChordOffset')
+        side = get_config('Wing','TipChordSide')
+        root_profile_thickness = get_config('RootChord','ProfileThickness')
+        tip_profile_thickness = get_config('TipChord', 'ProfileThickness')
+
+        rib1, rib2 = self.load_ribs()
+
         panel = Panel(rib1, rib2, get_config('Wing',"Width"))
-        kerf =  validate_kerf(get_config('Machine',"Kerf"))
+        kerf =  validate_kerf(get_config('Machine',"Kerf") if kerf is None else kerf)
         if side == "right":
             panel = Panel.reverse(panel)
             self.left_offset = root_offset
@@ -171,26 +338,10 @@ class GcodeGen():
         machine.safe_height = safe_height
         machine.foam_height = get_config('Panel',"Height")
 
-        machine.gc = Gcode(formatter_name=machine.gcode_formatter_name, 
-                units=machine.units, 
+        machine.gc = gcode_buffer.GcodeBuffer(units=machine.units, 
                 feedrate=machine.feedrate )
 
-        prepend_list = []
-        if get_config("Gcode","ConfigAsComment"):
-            prepend_list.append("Generated: %s" % datetime.datetime.now().isoformat())
-            config_str = self.config.config_as_str()
-            prepend_list.extend(config_str.split("\n"))
-            prepend = "\n;".join(prepend_list)
-            prepend = ";" + prepend
-        else:
-            prepend = None
-       
-
-        machine.gc.gcode_formatter = gcode_formatter.CustomGcodeFormatter(machine.gc,
-                             get_config("Gcode","AxisMapping"),
-                             get_config("Gcode","GcodeWireOn"),
-                             get_config("Gcode","GcodeWireOff"),
-                             prepend)
+        machine.gc.gcode_formatter = self.gcode_formatter(machine.gc)
 
         cs = trailing_cutting_strategy.TrailingEdgeCuttingStrategy(machine)
 
@@ -213,11 +364,18 @@ class GcodeGen():
                vertical_align_profiles,
                dihedral,
                inverted, get_config("Placement","RotateWing"),
-               side == "right", get_config("Wing","StockTrailingEdgeAngle"))
+               side == "right", get_config("Wing","StockTrailingEdgeAngle"), with_target)
 
-        machine.gc.normalize()
+        offset_x, offset_y = machine.gc.normalize()
 
         self.left_offset = bbox[0,0]
+        self.target = self.rib_planes = None
+        if with_target:
+            # x, y, u, v around the profiles without kerf, where the wire should leave the surface
+            x, y, u, v = cs.target
+            self.target = (x - offset_x, y - offset_y, u - offset_x, v - offset_y)
+            # planes of the left and right rib, moved along with the moves
+            self.rib_planes = [(p - np.array([0, offset_x, offset_y]), n) for p, n in cs.rib_planes]
 
 
         return machine.gc, bbox, wing
@@ -225,6 +383,34 @@ class GcodeGen():
 
 
 
+    def gcode_formatter(self, gc):
+        ''' CustomGcodeFormatter for gc with the [Gcode] options '''
+        get_config = self.config.get_config
+        prepend_list = []
+        if get_config("Gcode","ConfigAsComment"):
+            prepend_list.append("Generated: %s" % datetime.datetime.now().isoformat())
+            config_str = self.config.config_as_str()
+            prepend_list.extend(config_str.split("\n"))
+            prepend = "\n;".join(prepend_list)
+            prepend = ";" + prepend
+        else:
+            prepend = None
+
+        return gcode_formatter.CustomGcodeFormatter(gc,
+                             get_config("Gcode","AxisMapping"),
+                             get_config("Gcode","GcodeWireOn"),
+                             get_config("Gcode","GcodeWireOff"),
+                             prepend,
+                             get_config("Gcode","Precision"))
+
+    def format_gcode(self, gc):
+        ''' Formats the moves of an already cut gc with the units, feedrate and [Gcode] options of this config.
+            Enough when only options of the "gcode" stage changed, nothing is cut again'''
+        get_config = self.config.get_config
+        gc = gc.with_header(get_config('Project',"Units"), get_config('Machine',"Feedrate"))
+        gc.gcode_formatter = self.gcode_formatter(gc)
+        return gc.code_as_str
+
     def calc_wing_stats(self):
         ''' Calculate various metrics about the flying wing'''
         get_config = self.config.get_config
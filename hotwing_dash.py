@@ -3,7 +3,7 @@ import dash
 import dash_ace
 import dash_html_components as html
 import dash_core_components as dcc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
 from dash_extensions import Download
 from dash_extensions import Keyboard
@@ -11,6 +11,8 @@ from dash_extensions import Keyboard
 import gcode_gen
 import config_options
 import plotting
+import result_cache
+import job_pool
 
 import flask
 from flask import jsonify
@@ -27,9 +29,12 @@ UPLOAD_FOLDER = "/tmp"
 import unicodedata
 import string
 import base64
+import uuid
+import concurrent.futures
 
 import json
 import glob
+import numpy as np
 import traceback
 
 from utils import *
@@ -45,12 +50,18 @@ import subprocess
 
 
 
-cfg = config_options.Config()
-
 with open("example.cfg") as f:
     config_template = f.read()
 
 profile_cache = gcode_gen.ProfileCache("profiles")
+# generated gcode per config, so redrawing with a different selection or slider does not regenerate
+draw_cache = result_cache.ResultCache(max_entries=32, max_bytes=256 * 1024 * 1024)
+# gcode generation runs in worker processes, at most one job per browser session
+draw_pool = job_pool.JobPool(max_workers=2, max_queue=8, timeout=60, profile_path=profile_cache.path)
+# chained coordinates of the files uploaded to the Dxf to Gcode tab
+upload_cache = result_cache.ResultCache(max_entries=64, max_bytes=64 * 1024 * 1024, ttl=3600)
+# plan and profile outlines for the svg export, by the plot key of the drawing they belong to
+svg_cache = result_cache.ResultCache(max_entries=64, max_bytes=64 * 1024 * 1024, ttl=3600)
 CUSTOM_PROFILE_PATH = 'contrib/profiles'
 
 # Build App
@@ -66,6 +77,11 @@ app = dash.Dash(__name__,
 
 
 default_check_list = ["profile"] 
+# number of points the 3d preview is reduced to when Low Detail is checked, by default and at least
+LOD_MAX_POINTS = 2000
+LOD_MIN_POINTS = 100
+# decimals the figure data is rounded to before it is sent to the browser as float32
+FIGURE_DECIMALS = 2
 inline_checklist = dbc.FormGroup(
                 [
                     dbc.Checklist(
@@ -79,6 +95,7 @@ inline_checklist = dbc.FormGroup(
                             #{"label": "Final", "value": "final"},
                             {"label": "With Kerf", "value": "kerf"},
                             {"label": "3D", "value": "3d"},
+                            {"label": "Low Detail", "value": "lod"},
                             {"label": "Full Screen", "value": "full_screen"},
 
 
@@ -92,6 +109,27 @@ inline_checklist = dbc.FormGroup(
 
 
 
+lod_points_input = dbc.FormGroup(
+                [
+                    dbc.Label("Low Detail Points", html_for="lod-points", className="mr-2"),
+                    dbc.Input(id="lod-points", type="number", value=LOD_MAX_POINTS, min=LOD_MIN_POINTS, step=100,
+                              debounce=True, style={"width": "8em"}),
+                ],
+                className="mr-3",
+            )
+
+
+def lod_max_points(draw_selection, lod_points):
+    ''' point target of the 3d preview, None to draw every point '''
+    if "lod" not in draw_selection:
+        return None
+    try:
+        return max(int(lod_points), LOD_MIN_POINTS)
+    except (TypeError, ValueError):
+        return LOD_MAX_POINTS
+
+
+
 main_tab_layout = html.Div(id = "main-content")
 
 
@@ -165,14 +203,16 @@ gen_layout =  html.Div([
             ), className="col-6", id='editor-card',
         ),
         dbc.Col([
-            dbc.Form([inline_checklist]),
+            dbc.Form([inline_checklist, lod_points_input], inline=True),
             dbc.Card([
                 dbc.CardHeader([dbc.Row([
                                     dbc.Col(html.Div("Profile"),width=10) ,
                                     dbc.Col(dbc.Button(id="export-profile-svg",n_clicks=0,children='Export',color="primary", className="mr-2"), width=2)
 
                                     ], justify="between"),
-                                    dcc.Store(id="store-profile-svg"),
+                                    dcc.Store(id="store-plot-key"),
+                                    dcc.Store(id="store-profile-figure"),
+                                    dcc.Store(id="store-3d-figure"),
                                     dcc.Download(id="download-profile-svg")
                                 ],id="profile-header"),
                 dbc.CardBody(
@@ -185,7 +225,7 @@ gen_layout =  html.Div([
                                     dbc.Col(html.Div("Plan"), width=10), 
                                     dbc.Col(dbc.Button(id="export-plan-svg",n_clicks=0,children='Export',color="primary", className="mr-2"), width=2)
                                         ], justify="between"),
-                                        dcc.Store(id="store-plan-svg"),
+                                        dcc.Store(id="store-plan-figure"),
                                         dcc.Download(id="download-plan-svg")
                                 ], id="plan-header"),
                 dbc.CardBody(
@@ -353,6 +393,11 @@ dxf2gcode_tab_layout = html.Div([
                         'Scale',
                         dbc.Input(id="d2g-scale-factor", className="mr-1", type='number', value=1),
 
+                    ], className='col-2'),
+                    dbc.Col([
+                        'SVG Tolerance',
+                        dbc.Input(id="d2g-tolerance", className="mr-1", type='number', value=dxf_parser.SVGToGcode.TOLERANCE, min=0.0001, step=0.001),
+
                     ], className='col-2'),
 
                     dbc.Col([
@@ -391,9 +436,10 @@ dxf2gcode_tab_layout = html.Div([
               [Input('d2g-upload-data',"contents"), Input('d2g-submit-button','n_clicks'),
                Input('d2g-x-offset','value'), Input('d2g-y-offset','value'), 
                Input('d2g-rotate-angle','value'), Input('d2g-scale-factor','value'), 
+               Input('d2g-tolerance','value'),
                 ],
               [ State('d2g-filename','value'), State('d2g-upload-data', 'filename'),])
-def draw_dxf(contents, n, x_offset, y_offset, rotate_angle, scale_factor, stored_filename, uploaded_filename):
+def draw_dxf(contents, n, x_offset, y_offset, rotate_angle, scale_factor, tolerance, stored_filename, uploaded_filename):
 
     ctx = dash.callback_context
 
@@ -417,7 +463,7 @@ def draw_dxf(contents, n, x_offset, y_offset, rotate_angle, scale_factor, stored
             with open(stored_filename, "wb") as f:
                 f.write(decoded)
 
-        dxfp = dxf_parser.create_parser(stored_filename)
+        dxfp = dxf_parser.load_parser(stored_filename, upload_cache, tolerance)
 
         x_series, y_series, x_offset, y_offset, rotate_angle, scale_factor = dxfp.to_xy_array(x_offset, y_offset,rotate_angle, scale_factor, ignore_offset= button_id == "d2g-upload-data")
 
@@ -443,9 +489,9 @@ def draw_dxf(contents, n, x_offset, y_offset, rotate_angle, scale_factor, stored
 @server.route('/selig/<path:filename>')
 def selig_link(filename):
     #filename = "/".join(filename.split("/")[1:])
-    dxfp = dxf_parser.create_parser("/"+filename[:-4])  
+    dxfp = dxf_parser.load_parser("/"+filename[:-4], upload_cache)
     profilename=  werkzeug.utils.secure_filename(filename)
-    output = dxfp.to_selig(profilename)
+    output = dxfp.to_selig(profilename, 0, 0, 0, 1)
     output = "\n".join(output)
 
     return output
@@ -456,12 +502,13 @@ def selig_link(filename):
                 [State('uploaded-filename','value'), State('d2g-filename','value'), 
                 State('d2g-x-offset','value'), State('d2g-y-offset','value'),
                  State('d2g-rotate-angle','value'), State('d2g-scale-factor','value'), 
-                State('d2g-four-axes','value'), State('d2g-feedrate','value'), State('d2g-pwm','value')
+                State('d2g-four-axes','value'), State('d2g-feedrate','value'), State('d2g-pwm','value'),
+                State('d2g-tolerance','value')
 
                 ], prevent_initial_call=True)
-def download_d2g_gcode(n_clicks, uploaded_filename, stored_filename, x_offset, y_offset,rotate_angle,scale_factor, four_axis, feedrate, pwm):
+def download_d2g_gcode(n_clicks, uploaded_filename, stored_filename, x_offset, y_offset,rotate_angle,scale_factor, four_axis, feedrate, pwm, tolerance):
 
-    dxfp = dxf_parser.create_parser(stored_filename)
+    dxfp = dxf_parser.load_parser(stored_filename, upload_cache, tolerance)
     gcode = dxfp.to_gcode(x_offset, y_offset, rotate_angle, scale_factor, four_axis=='4', feedrate, pwm)
 
     _,extension =  os.path.splitext(stored_filename)
@@ -478,22 +525,30 @@ def download_d2g_gcode(n_clicks, uploaded_filename, stored_filename, x_offset, y
         [State('uploaded-filename','value'), State('d2g-filename','value'), 
                 State('d2g-x-offset','value'), State('d2g-y-offset','value'),
                   State('d2g-rotate-angle','value'), State('d2g-scale-factor','value'), 
-                State('d2g-four-axes','value'), State('d2g-feedrate','value'), State('d2g-pwm','value')
+                State('d2g-four-axes','value'), State('d2g-feedrate','value'), State('d2g-pwm','value'),
+                State('d2g-tolerance','value')
         ])
-def download_selig(selig_clicks,  uploaded_filename, stored_filename, x_offset, y_offset, rotate_angle, scale_factor, four_axis, feedrate, pwm):
-    dxfp = dxf_parser.create_parser(stored_filename)  
+def download_selig(selig_clicks,  uploaded_filename, stored_filename, x_offset, y_offset, rotate_angle, scale_factor, four_axis, feedrate, pwm, tolerance):
+    dxfp = dxf_parser.load_parser(stored_filename, upload_cache, tolerance)  
     output = dxfp.to_selig(uploaded_filename, x_offset, y_offset, rotate_angle, scale_factor)
     
     return dict(content="\n".join(output), filename = uploaded_filename+".dat")  
 
 
 
-app.layout = dbc.Tabs([
-    dbc.Tab(info_tab_layout, label="Info"),
-    dbc.Tab(main_tab_layout, label="Wing Gcode"),
-    dbc.Tab(dxf2gcode_tab_layout, label="Dxf to Gcode"),
-    dbc.Tab(gallery_tab_layout, label="Gallery"),
-], id="tabs")
+def serve_layout():
+    # a new session id for every page load, a new Draw cancels the session's previous one
+    return html.Div([
+        dcc.Store(id="session-id", data=str(uuid.uuid4())),
+        dbc.Tabs([
+            dbc.Tab(info_tab_layout, label="Info"),
+            dbc.Tab(main_tab_layout, label="Wing Gcode"),
+            dbc.Tab(dxf2gcode_tab_layout, label="Dxf to Gcode"),
+            dbc.Tab(gallery_tab_layout, label="Gallery"),
+        ], id="tabs")
+    ])
+
+app.layout = serve_layout
 
 
 
@@ -504,7 +559,7 @@ app.layout = dbc.Tabs([
               [State('gcode', 'value'),State('input', 'value')]   )
 def save_config(n_nlicks, gcode_input, config_input):
 
-    cfg.read_string(config_input)
+    cfg = config_options.load_config(config_input)
     pn = cfg.get_config("Project","Name")
     filename = "%s.gcode" % removeDisallowedFilenameChars(pn)
 
@@ -514,14 +569,17 @@ def save_config(n_nlicks, gcode_input, config_input):
 
 @app.callback(Output("download-plan-svg", "data"), 
               [Input("export-plan-svg", "n_clicks")], 
-              [State('store-plan-svg', 'data'), State('input', 'value')])
-def download_plan_svg(n_nlicks, data, config_input):
+              [State('store-plot-key', 'data'), State('input', 'value'), State("checklist-input", "value"),
+               State('session-id', 'data')])
+def download_plan_svg(n_nlicks, plot_key, config_input, draw_selection, session_id):
 
 
-    cfg.read_string(config_input)
+    cfg = config_options.load_config(config_input)
     pn = cfg.get_config("Project","Name")
     filename = "%s_plan.svg" % removeDisallowedFilenameChars(pn)
 
+    data, _ = svg_data(plot_key, cfg, config_input, draw_selection, session_id)
+
     path, bbox = dxf_parser.series_to_path(data, max(data['y']))
     output = dxf_parser.paths_to_str([path],[bbox])
     return dict(content=output, filename=filename)
@@ -529,14 +587,16 @@ def download_plan_svg(n_nlicks, data, config_input):
 
 @app.callback(Output("download-profile-svg", "data"), 
               [Input("export-profile-svg", "n_clicks")], 
-              [State('store-profile-svg', 'data'),State('input', 'value')])
-def download_profile_svg(n_nlicks, data, config_input):
+              [State('store-plot-key', 'data'), State('input', 'value'), State("checklist-input", "value"),
+               State('session-id', 'data')])
+def download_profile_svg(n_nlicks, plot_key, config_input, draw_selection, session_id):
 
 
-    cfg.read_string(config_input)
+    cfg = config_options.load_config(config_input)
     pn = cfg.get_config("Project","Name")
     filename = "%s_profile.svg" % removeDisallowedFilenameChars(pn)
 
+    _, data = svg_data(plot_key, cfg, config_input, draw_selection, session_id)
     data = dxf_parser.simplify_profile(data)
 
     max_y = max(max(data['left']['y']), max(data['right']['y']))
@@ -595,24 +655,72 @@ def reload_gallery(n):
     return result.decode("utf-8"), load_gallery_file()
 
 
+def cached_gcode(result, cfg):
+    ''' gcode of a cached DrawResult for cfg, the moves are only formatted again when options of the gcode stage changed '''
+    if result.gcode_key == result_cache.stage_key(cfg, "gcode"):
+        return result.gcode
+    return gcode_gen.GcodeGen(cfg, profile_cache).format_gcode(result.gc)
+
+
+def get_draw_result(cfg, config_input, draw_selection, session_id):
+    ''' DrawResult for the cut of cfg, from the draw cache or generated in the draw pool '''
+    # only the kerf checkbox changes the generated gcode, the rest of the selection is just filtering.
+    # Changes to options that do not change the cut (see config_options.STAGE_DEPENDENCIES) reuse the cut moves
+    with_kerf = "kerf" in draw_selection
+    key = result_cache.stage_key(cfg, "cut", with_kerf)
+    result = draw_cache.get(key)
+    if result is None:
+        try:
+            result = draw_pool.run(session_id, job_pool.generate_draw_result, config_input, with_kerf)
+        except concurrent.futures.CancelledError:
+            # a newer Draw from the same session replaced this one
+            raise PreventUpdate
+        draw_cache.put(key, result)
+    return result
+
+
+def make_plotter(cfg, result):
+    get_config = cfg.get_config
+    bbox = result.bbox
+    return plotting.GcodePlotter(get_config('Machine',"Width"), get_config('Machine',"Height"), get_config('Machine',"Depth"),
+                                 result.left_offset, bbox[1,0] - bbox[0,0],
+                                 get_config('Panel','Bottom'), get_config('Panel','Height'),
+                                 get_config('Panel','Inset'), get_config('Panel','Depth'), result.wing_plan, bbox)
+
+
+def svg_data(plot_key, cfg, config_input, draw_selection, session_id):
+    ''' plan and profile outlines of the drawing with plot_key, drawn again if this worker does not have them '''
+    data = svg_cache.get(plot_key) if plot_key is not None else None
+    if data is None:
+        # a job of its own, so an export never cancels a Draw of the same session that is still queued
+        result = get_draw_result(cfg, config_input, draw_selection, session_id + ":svg")
+        gplt = make_plotter(cfg, result)
+        pgc_filtered = result.pgc.filter_gcode(draw_selection)
+        _, profile_data = gplt.plot_gcode_2dprofile(pgc_filtered, draw_cutting_path=True,
+                                       draw_foam_block=True, draw_machine_block = False)
+        _, plan_data = gplt.plot_gcode_2dplan(pgc_filtered, draw_cutting_path=True,draw_foam_block=True, 
+                                    draw_machine_block = True)
+        data = (plan_data, profile_data)
+    return data
+
+
 @app.callback([Output('output-state', 'children'), 
-                Output("graph", "figure"),
-                Output("graph_profile", "figure"), 
-                Output("graph_plan", "figure"), 
+                Output("store-3d-figure", "data"),
+                Output("store-profile-figure", "data"), 
+                Output("store-plan-figure", "data"), 
                 Output('gcode','value'), 
                 Output('editor-card', 'style'),
                 Output('stats-div','children'),
-                Output('store-plan-svg','data'),
-                Output('store-profile-svg','data'),
+                Output('store-plot-key','data'),
                 ],
               [Input('submit-button-state', 'n_clicks'), 
                Input("checklist-input", "value"),
-               Input("point-slider","value"),
-               Input("keyboard", "keydown")], 
-              State('input', 'value')
+               Input("keyboard", "keydown"),
+               Input("lod-points", "value")], 
+              [State('input', 'value'), State('session-id', 'data'), State('store-plot-key', 'data')]
               
               )
-def update_output(n_clicks, draw_selection, point_slider, keyboard_event, config_input):
+def update_output(n_clicks, draw_selection, keyboard_event, lod_points, config_input, session_id, last_plot_key):
     ctx = dash.callback_context
     input_trigger = ctx.triggered[0]['prop_id'].split('.')[0]
 
@@ -627,8 +735,10 @@ def update_output(n_clicks, draw_selection, point_slider, keyboard_event, config
     validation = []
 
     output_error_msg = {} 
+    plot_key = None
     try:
-        validation = cfg.read_string(config_input)
+        cfg = config_options.load_config(config_input)
+        validation = cfg.validation
         if validation:
             if config_input == "":
                 err_msg = ""
@@ -637,51 +747,34 @@ def update_output(n_clicks, draw_selection, point_slider, keyboard_event, config
             output_error_msg = dbc.Alert(err_msg, color="danger")
             raise Exception("Validation Failed")
             
-        # remove the kerf by setting to zero to visualize the profiles
-        if "kerf" not in draw_selection:
-            old_kerf = cfg.get_config('Machine','Kerf')
-            cfg.config.set('Machine','Kerf', "0")
-
-        gc_gen = gcode_gen.GcodeGen(cfg, profile_cache)
-        gc, bbox, wing_plan = gc_gen.gen_gcode()
-        gcode_output = gc.code_as_str
-        
-        pgc = plotting.ParsedGcode.fromgcode(gc)
+        result = get_draw_result(cfg, config_input, draw_selection, session_id)
 
-        machine_width = cfg.get_config('Machine',"Width")
-        machine_height=cfg.get_config('Machine',"Height")
-        machine_depth=cfg.get_config('Machine',"Depth")
+        gcode_output = cached_gcode(result, cfg)
+        editor_visible = EDITOR_HIDE if "full_screen" in draw_selection else EDITOR_SHOW
 
-        panel_offset = gc_gen.left_offset
-        panel_width = bbox[1,0] - bbox[0,0]
+        max_points = lod_max_points(draw_selection, lod_points)
+        plot_key = result_cache.stage_key(cfg, "plot", sorted(draw_selection), max_points)
+        if plot_key == last_plot_key:
+            # nothing the figures depend on changed, only send the new gcode
+            return (output_error_msg, dash.no_update, dash.no_update, dash.no_update, gcode_output, editor_visible,
+                    dash.no_update, plot_key)
 
-        panel_bottom = cfg.get_config('Panel','Bottom')
-        panel_height = cfg.get_config('Panel','Height')
+        machine_depth=cfg.get_config('Machine',"Depth")
         panel_inset = cfg.get_config('Panel','Inset')
         panel_depth = cfg.get_config('Panel','Depth')
 
-        gplt = plotting.GcodePlotter(machine_width,machine_height, machine_depth,
-                                    panel_offset, panel_width,
-                                    panel_bottom, panel_height, 
-                                    panel_inset, panel_depth, wing_plan, bbox)
-        pgc_filtered = pgc.filter_gcode(draw_selection)
+        gplt = make_plotter(cfg, result)
+        pgc_filtered = result.pgc.filter_gcode(draw_selection)
 
 
-        fig, stats_3d = gplt.plot_gcode(pgc_filtered, draw_cutting_path=True,draw_foam_block=True, num_of_points=-1)
-        wing_stats = gc_gen.calc_wing_stats()
-        stats_3d['wing_stats'] = wing_stats
+        fig, stats_3d = gplt.plot_gcode(pgc_filtered, draw_cutting_path=True,draw_foam_block=True, num_of_points=-1,
+                                        max_points=max_points)
+        stats_3d['wing_stats'] = result.wing_stats
 
         stats_output = json.dumps(stats_3d)
 
         if "3d" in draw_selection:
-
-            point_perc = float(point_slider) / 100.0
-            num_of_points = int(point_perc * len(pgc_filtered))
-
-            if point_perc != 1:
-                fig, _ = gplt.plot_gcode(pgc_filtered, draw_cutting_path=True,draw_foam_block=True, num_of_points=num_of_points)
-
-
+            # the full figure goes to the browser once, the point slider reveals the cut there (reveal_3d_figure)
             camera = dict(
                 eye=dict(x=-2.5, y=-2.5, z=2.5)
             )
@@ -693,12 +786,6 @@ def update_output(n_clicks, draw_selection, point_slider, keyboard_event, config
         else:
             fig = {}
 
-        if "full_screen" in draw_selection:
-            editor_visible = EDITOR_HIDE
-        else:
-            editor_visible = EDITOR_SHOW
-        
-        
         fig_p, profile_data = gplt.plot_gcode_2dprofile(pgc_filtered, draw_cutting_path=True,
                                        draw_foam_block=True, draw_machine_block = False,
                                        num_of_points=-1)
@@ -760,13 +847,15 @@ def update_output(n_clicks, draw_selection, point_slider, keyboard_event, config
             orientation="h"
         ))
 
-        # put old kerf back to make sure gcode in output box contains the right kerf setting
-        if "kerf" not in draw_selection:
-            cfg.config.set('Machine','Kerf', old_kerf)
-            gc_gen = gcode_gen.GcodeGen(cfg, profile_cache)
-            gc, _, _ = gc_gen.gen_gcode()
-            gcode_output = gc.code_as_str
-  
+        svg_cache.put(plot_key, (plan_data, profile_data))
+
+        # the figures go to the browser as typed arrays, static/figures.js decodes them
+        fig = plotting.encode_figure(fig, FIGURE_DECIMALS)
+        fig_p = plotting.encode_figure(fig_p, FIGURE_DECIMALS)
+        fig_plan = plotting.encode_figure(fig_plan, FIGURE_DECIMALS)
+
+    except PreventUpdate:
+        raise
     except Exception as e:
         traceback.print_exc()
         if not validation:
@@ -777,10 +866,20 @@ def update_output(n_clicks, draw_selection, point_slider, keyboard_event, config
         gcode_output = "Error: %s" % str(e)
         editor_visible = EDITOR_SHOW
         stats_output = ""
-        plan_data = {}
-        profile_data = {}
+        plot_key = None
     
-    return output_error_msg, fig, fig_p, fig_plan, gcode_output, editor_visible, stats_output, plan_data, profile_data
+    return output_error_msg, fig, fig_p, fig_plan, gcode_output, editor_visible, stats_output, plot_key
+
+# the point slider reveals the 3d cut in the browser, without a round trip to the server
+app.clientside_callback(ClientsideFunction(namespace="figures", function_name="reveal_3d_figure"),
+    Output("graph", "figure"),
+    [Input("store-3d-figure", "data"), Input("point-slider", "value")])
+
+app.clientside_callback(ClientsideFunction(namespace="figures", function_name="decode_figure"),
+    Output("graph_profile", "figure"), Input("store-profile-figure", "data"))
+
+app.clientside_callback(ClientsideFunction(namespace="figures", function_name="decode_figure"),
+    Output("graph_plan", "figure"), Input("store-plan-figure", "data"))
 
 @app.callback(Output("chart-card","className"),
                Input("editor-card","style"))
@@ -874,14 +973,14 @@ def autocompleter():
     elif '=' in prefix:
         parameter = prefix.split("=")[0].strip()
         parameter_lookup = prefix.split("=")[-1]
-        for heading, section in cfg.CONFIG_OPTIONS.items():
+        for heading, section in config_options.CONFIG_OPTIONS.items():
             param_confg = section.get(parameter, {}) 
             domain = param_confg.get("domain",[])
             for d in domain:
                 autocomplete.append({"name": d, "value": d, "score": 1000, "meta": "Parameter"})
 
     else:
-        for heading, section in cfg.CONFIG_OPTIONS.items():
+        for heading, section in config_options.CONFIG_OPTIONS.items():
             for keyword, meta in section.items():
                 if keyword.lower().startswith(prefix.lower()):
                     autocomplete.append({"name": keyword, "value": keyword, "score": 100, "meta": "Config"})
@@ -889,6 +988,60 @@ def autocompleter():
 
 
 
+@server.route('/status')
+def status():
+    return jsonify({'draw_pool': draw_pool.stats(), 'draw_cache': draw_cache.stats(), 
+                    'upload_cache': upload_cache.stats(), 'svg_cache': svg_cache.stats()})
+
+
+API_CHUNK_LINES = 5000
+
+@server.route('/api/gcode', methods=['POST'])
+def api_gcode():
+    ''' Generates the gcode for the wing config in the request body (or the "config" form field), without any plotting.
+        Returns the gcode as a streamed text/plain response, or with ?format=json the bbox, wing plan and stats '''
+    config_input = request.form.get("config") or request.get_data(as_text=True)
+    as_json = request.args.get("format") == "json"
+
+    cfg = config_options.load_config(config_input)
+    if cfg.validation:
+        return jsonify({'error': "Validation Failed", 'validation': cfg.validation}), 400
+
+    # a Draw with kerf already cut the same moves. A Draw without kerf has the gcode too,
+    # but its bbox and wing plan are those of the zero kerf preview
+    result = draw_cache.get(result_cache.stage_key(cfg, "cut", True))
+    if result is None and not as_json:
+        result = draw_cache.get(result_cache.stage_key(cfg, "cut", False))
+    if result is None:
+        key = result_cache.stage_key(cfg, "cut", "api")
+        result = draw_cache.get(key)
+        if result is None:
+            try:
+                # every request is its own session, api calls never cancel each other
+                result = draw_pool.run(uuid.uuid4().hex, job_pool.generate_gcode_result, config_input)
+            except job_pool.QueueFull as e:
+                return jsonify({'error': str(e)}), 503
+            except job_pool.JobTimeout as e:
+                return jsonify({'error': str(e)}), 504
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+            draw_cache.put(key, result)
+
+    if as_json:
+        # the wing plan is a list when the wing is not rotated
+        return jsonify({'bbox': np.asarray(result.bbox).tolist(), 'wing_plan': np.asarray(result.wing_plan).tolist(),
+                        'left_offset': float(result.left_offset), 'wing_stats': result.wing_stats})
+
+    lines = cached_gcode(result, cfg).split("\n")
+    def generate():
+        for i in range(0, len(lines), API_CHUNK_LINES):
+            yield "\n".join(lines[i:i + API_CHUNK_LINES]) + ("\n" if i + API_CHUNK_LINES < len(lines) else "")
+
+    filename = "%s.gcode" % removeDisallowedFilenameChars(cfg.get_config("Project","Name"))
+    return flask.Response(flask.stream_with_context(generate()), mimetype="text/plain",
+                          headers={'Content-Disposition': 'attachment; filename="%s"' % filename})
+
+
 @server.route('/img/<path:filename>')
 def custom_static(filename):
     return send_from_directory("contrib/img", filename)
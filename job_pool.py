@@ -0,0 +1,223 @@
+''' Runs the gcode generation of the Draw callback in a pool of worker processes,
+    so a heavy wing does not block the web worker for everyone else '''
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+
+import config_options
+import gcode_gen
+import plotting
+import result_cache
+
+
+# profile cache of a worker process, loaded profiles are kept for all the jobs it runs
+_profile_cache = None
+
+
+def init_worker(profile_path):
+    ''' initializer of a worker process, opens its ProfileCache '''
+    global _profile_cache
+    _profile_cache = gcode_gen.ProfileCache(profile_path)
+
+
+def profile_cache():
+    ''' the ProfileCache of this worker process, None outside of a worker '''
+    return _profile_cache
+
+
+def generate_draw_result(config_string, with_kerf, profile_cache=None):
+    ''' Generates the gcode and everything needed to plot it for the config in config_string.
+        The plotted path has no kerf, unless with_kerf is set'''
+    cfg = config_options.load_config(config_string)
+    gc_gen = gcode_gen.GcodeGen(cfg, profile_cache or _profile_cache)
+    if with_kerf:
+        gc, bbox, wing_plan = gc_gen.gen_gcode()
+        gcode_output = gc.code_as_str
+    else:
+        # remove the kerf by setting to zero to visualize the profiles
+        gc, bbox, wing_plan = gc_gen.gen_gcode(kerf="0")
+
+    pgc = plotting.ParsedGcode.fromgcode(gc)
+    left_offset = gc_gen.left_offset
+
+    # rerun with the configured kerf to make sure gcode in output box contains the right kerf setting
+    # the profiles loaded for the preview are reused
+    if not with_kerf:
+        gc, _, _ = gc_gen.gen_gcode()
+        gcode_output = gc.code_as_str
+
+    return result_cache.DrawResult(gcode_output, pgc, bbox, wing_plan, left_offset, gc_gen.calc_wing_stats(),
+                                   gc, result_cache.stage_key(cfg, "gcode"))
+
+
+def generate_gcode_result(config_string, profile_cache=None):
+    ''' Generates only the gcode for the config in config_string, with the configured kerf.
+        Nothing is parsed for plotting, the pgc of the returned DrawResult is None'''
+    cfg = config_options.load_config(config_string)
+    gc_gen = gcode_gen.GcodeGen(cfg, profile_cache or _profile_cache)
+    gc, bbox, wing_plan = gc_gen.gen_gcode()
+    return result_cache.DrawResult(gc.code_as_str, None, bbox, wing_plan, gc_gen.left_offset, gc_gen.calc_wing_stats(),
+                                   gc, result_cache.stage_key(cfg, "gcode"))
+
+
+def python_executable():
+    ''' the Python interpreter to spawn workers with. Under uWSGI sys.executable is the uwsgi binary,
+        then HOTWING_PYTHON, the python3 next to the one running the app, or the one on the PATH '''
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    if os.environ.get("HOTWING_PYTHON"):
+        return os.environ["HOTWING_PYTHON"]
+    for name in ("bin/python3", "bin/python", "python.exe"):
+        candidate = os.path.join(sys.exec_prefix, name)
+        if os.path.isfile(candidate):
+            return candidate
+    candidate = shutil.which("python3")
+    if candidate is None:
+        raise Exception("No Python interpreter found to start the workers with, set HOTWING_PYTHON")
+    return candidate
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+class JobPool():
+    ''' Bounded process pool with at most one job in flight per session.
+        Submitting a new job for a session cancels the previous one if it has not started yet,
+        the previous caller then gets a concurrent.futures.CancelledError '''
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=60, profile_path="profiles"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.profile_path = profile_path
+
+        self.queue_depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.restarts = 0
+
+        self._executor = None
+        self._sessions = {}
+        # cancel() runs the done callback, which takes the lock too, in the same thread
+        self._lock = threading.RLock()
+
+    def _get_executor(self):
+        # started on first use, so forked web workers each get their own pool
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(python_executable())
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                                max_workers=self.max_workers,
+                                mp_context=context,
+                                initializer=init_worker,
+                                initargs=(self.profile_path,))
+        return self._executor
+
+    def _restart(self, executor):
+        ''' drops executor after a worker died, the next job starts a new pool.
+            Every job that was queued on it fails at once, only the first one to notice restarts the pool '''
+        with self._lock:
+            if self._executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.restarts += 1
+
+    def _kill(self, executor):
+        ''' stops the workers of executor, to get back the one running a job that timed out.
+            The jobs running on the other workers fail with BrokenProcessPool, run() starts them again '''
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        # ProcessPoolExecutor can not cancel a running job, only its processes can be stopped
+        for process in list(executor._processes.values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+
+    def submit(self, session, fn, *args):
+        ''' queues fn(*args) for session, returns its Future '''
+        return self._submit(session, fn, *args)[0]
+
+    def _submit(self, session, fn, *args):
+        ''' submit, also returns the executor the job was queued on '''
+        with self._lock:
+            stale = self._sessions.pop(session, None)
+            if stale is not None and stale.cancel():
+                self.cancelled += 1
+
+            if self.queue_depth >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull("The server is busy (%d drawings queued), try again in a moment" % self.queue_depth)
+
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # a worker died since the last job, nobody was waiting on the pool to notice
+                self._restart(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+            self.queue_depth += 1
+            self.submitted += 1
+            self._sessions[session] = future
+
+        future.add_done_callback(lambda f: self._done(session, f))
+        return future, executor
+
+    def _done(self, session, future):
+        with self._lock:
+            self.queue_depth -= 1
+            if not future.cancelled():
+                self.completed += 1
+            if self._sessions.get(session) is future:
+                del self._sessions[session]
+
+    def run(self, session, fn, *args):
+        ''' submits fn(*args) and waits at most timeout seconds for its result.
+            A job still running after timeout seconds is stopped along with the pool it runs on.
+            A job that was lost because a worker died (a crash, the OOM killer or a timeout of another job)
+            is run once more on a new pool '''
+        for attempt in range(2):
+            future, executor = self._submit(session, fn, *args)
+            try:
+                return self._result(future, executor)
+            except BrokenProcessPool:
+                self._restart(executor)
+        raise WorkerCrashed("A worker process died while generating the gcode, twice in a row")
+
+    def _result(self, future, executor):
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            if not future.cancel():
+                # it already started, its worker would stay busy until it is done
+                self._kill(executor)
+            with self._lock:
+                self.timeouts += 1
+            raise JobTimeout("Generating the gcode took longer than %s seconds" % self.timeout)
+
+    def stats(self):
+        return {'queue_depth': self.queue_depth, 'workers': self.max_workers, 'max_queue': self.max_queue,
+                'submitted': self.submitted, 'completed': self.completed, 'cancelled': self.cancelled,
+                'timeouts': self.timeouts, 'rejected': self.rejected, 'restarts': self.restarts}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
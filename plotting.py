@@ -1,83 +1,134 @@
+import base64
+
 import numpy as np
 import plotly.graph_objects as go
 
 
-from utils import argmax,argmin, project_line
+from utils import argmax,argmin, isect_lines_plane_v3, ffill
+from gcode_buffer import tag_mask, tag_names, COMMAND_TYPES, TAG_BITS
+
+# meta of the 3d meshes the point slider reveals in the browser, the first 2*(n-1) triangles
+# of a mesh from calc_vertices show the cut up to its n-th point
+PROGRESS_META = "progress"
+
+# trace attributes sent to the browser as base64 typed arrays by encode_figure
+TYPED_ARRAY_ATTRIBUTES = ('x', 'y', 'z', 'i', 'j', 'k', 'intensity')
+
+
+def encode_array(a, decimals=2):
+    ''' numeric array as {"dtype", "bdata"}: base64 of the little endian values. Whole numbers (mesh indices,
+        intensity) are stored in the smallest of uint8, uint16 and int32 they fit, the rest as float32 rounded
+        to decimals. static/figures.js decodes them in the browser '''
+    a = np.asarray(a)
+    if a.dtype.kind != "f":
+        a = a.astype(float)
+    a = np.round(a, decimals)
+    data = a.astype("<f4")
+    if len(a) and np.array_equal(a, np.round(a)):
+        low, high = a.min(), a.max()
+        for dtype in ("<u1", "<u2", "<i4"):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                data = a.astype(dtype)
+                break
+    return {"dtype": data.dtype.str[1:], "bdata": base64.b64encode(data.tobytes()).decode()}
+
+
+def encode_figure(fig, decimals=2):
+    ''' plotly figure as a dict with its numeric data arrays encoded by encode_array, 
+        a fraction of the size of plotly's JSON and much faster to serialize '''
+    if not isinstance(fig, go.Figure):
+        return fig
+    data = []
+    for trace in fig.data:
+        t = trace.to_plotly_json()
+        for attr in TYPED_ARRAY_ATTRIBUTES:
+            v = t.get(attr)
+            if v is not None and not isinstance(v, str) and np.asarray(v).dtype.kind in "iufb":
+                t[attr] = encode_array(v, decimals)
+        data.append(t)
+    return {"data": data, "layout": fig.layout.to_plotly_json()}
 
 
 class ParsedGcode:
+    ''' the moves of a cut as arrays: X, Y, U, V coordinates, TAG bitmasks of gcode_buffer.TAGS and 
+        KIND opcodes of gcode_buffer.COMMAND_TYPES. The arrays are not changed after construction,
+        methods return a new ParsedGcode '''
 
     @classmethod
     def fromgcode(cls, gcode):
-        def impute(f, H):
-            if f is None and len(H)>0:
-                f = H[-1]
-            elif f is None:
-                f = 0.0
-            return f
-
-        commands = gcode._commands
-        X, Y, U, V, TAG, KIND = [],[],[],[],[],[]
-        for c in commands:
-            if c.type_ in ["MOVE","FAST_MOVE"]:
-                X.append(impute(c.data.get('x',None), X))
-                Y.append(impute(c.data.get('y',None), Y))
-                U.append(impute(c.data.get('u',None), U))
-                V.append(impute(c.data.get('v',None), V))
-                TAG.append(c._options)
-                KIND.append(c.type_)
-                    
-        return cls(X,Y,U,V,TAG, KIND)
+        ''' reads the moves straight from the columns of a GcodeBuffer, 
+            axes a move does not specify keep the value of the previous move'''
+        moves = gcode.is_move()
+        X, Y, U, V = [ffill(col[moves]) for col in (gcode.x, gcode.y, gcode.u, gcode.v)]
+
+        return cls(X,Y,U,V,gcode.tags[moves], gcode.opcode[moves])
 
         
     def __init__(self, X,Y,U,V,TAG, KIND):
-        self.X = X
-        self.Y = Y
-        self.U = U
-        self.V = V
-        self.TAG = TAG
-        self.KIND = KIND
+        ''' TAG and KIND are arrays of bitmasks and opcodes, or lists of tag names and command names '''
+        self.X = np.asarray(X, float)
+        self.Y = np.asarray(Y, float)
+        self.U = np.asarray(U, float)
+        self.V = np.asarray(V, float)
+        self.TAG = self._as_array(TAG, lambda t: tag_mask([t] if isinstance(t, str) else t))
+        self.KIND = self._as_array(KIND, COMMAND_TYPES.index)
+        self._rounded = {}
+
+    @staticmethod
+    def _as_array(values, convert):
+        # lists of names (or of per move tag lists, which can be ragged) are converted one by one
+        if isinstance(values, (list, tuple)):
+            return np.array([convert(v) for v in values], int)
+        a = np.asarray(values)
+        if a.dtype.kind in "iu":
+            return a
+        return np.array([convert(v) for v in a.tolist()], int)
 
     def zip(self):
-        return zip(self.X, self.Y, self.U, self.V, self.TAG, self.KIND)
+        return zip(self.X, self.Y, self.U, self.V, 
+                   [tag_names(t) for t in self.TAG.tolist()], [COMMAND_TYPES[k] for k in self.KIND.tolist()])
 
     def __len__(self):
         return len(self.X)
 
+    def take(self, idx):
+        ''' new ParsedGcode with only the points at the indices, or where the boolean mask, in idx is set '''
+        return ParsedGcode(self.X[idx], self.Y[idx], self.U[idx], self.V[idx], self.TAG[idx], self.KIND[idx])
 
-    def filter_gcode(self, options_to_include = ["initial_move","profile","done_profile", "front_stock", "tail_stock"], kind_to_include=["MOVE","FAST_MOVE"]):
-        X_f, Y_f, U_f, V_f, TAG_f, KIND_f = [],[],[],[],[], []
-
-        for x,y,u,v,t,k in self.zip():
-            int_tag = set(t).intersection(options_to_include)
-            if len(int_tag) > 0 and k in kind_to_include:
-                X_f.append(x)
-                Y_f.append(y)
-                U_f.append(u)
-                V_f.append(v)
-                TAG_f.append(int_tag.pop())
-                KIND_f.append(k)
-
-        return ParsedGcode(X_f, Y_f, U_f, V_f, TAG_f, KIND_f)
 
-    def _round(self, a):
-        return np.round(np.array(a, 'float32'),2)
+    def filter_gcode(self, options_to_include = ["initial_move","profile","done_profile", "front_stock", "tail_stock"], kind_to_include=["MOVE","FAST_MOVE"]):
+        ''' new ParsedGcode with the points of kind_to_include that have any of the tags in options_to_include, 
+            their TAG only keeps those tags '''
+        # the draw selection also holds options that are not tags, like kerf and 3d
+        include = tag_mask(o for o in options_to_include if o in TAG_BITS)
+        keep = (self.TAG & include != 0) & np.isin(self.KIND, [COMMAND_TYPES.index(k) for k in kind_to_include])
+        filtered = self.take(keep)
+        filtered.TAG = filtered.TAG & include
+        return filtered
+
+    def _round(self, axis):
+        ''' axis rounded to 2 decimals as float32, computed once '''
+        rounded = self._rounded.get(axis)
+        if rounded is None:
+            rounded = self._rounded[axis] = np.round(getattr(self, axis).astype('float32'), 2)
+        return rounded
 
     @property
     def round_X(self):
-        return self._round(self.X)
+        return self._round("X")
 
     @property
     def round_Y(self):
-        return self._round(self.Y)
+        return self._round("Y")
 
     @property
     def round_U(self):
-        return self._round(self.U)
+        return self._round("U")
 
     @property
     def round_V(self):
-        return self._round(self.V)
+        return self._round("V")
 
 class GcodeBox():
     def __init__(self, box_left, box_width, box_bottom, box_height, box_inset, box_depth):
@@ -119,21 +170,16 @@ class GcodePlotter():
         ''' Projects the gcode coordinates in X, Y, U & V onto the foam block start (left_offset) and foamblock end (left_offset+panelwidth)
             Used to visualize the wing no the foam block'''
 
-
-
+        # line from (0, X, Y) to (width, U, V) for every point, intersected with both foam planes at once
         n = len(pgc)
-        X1, Y1, U1, V1 = [], [], [], []
+        c1_3d = (np.zeros(n), np.asarray(pgc.X, float), np.asarray(pgc.Y, float))
+        c2_3d = (np.full(n, from_box.width, float), np.asarray(pgc.U, float), np.asarray(pgc.V, float))
+        p_no = (1, 0, 0)
 
-        for i in range(n):
-            a = project_line(pgc.X[i], pgc.Y[i], pgc.U[i], pgc.V[i], from_box.width, to_box.left)
-            X1.append(a[1])
-            Y1.append(a[2])
-            
-            b = project_line(pgc.X[i], pgc.Y[i], pgc.U[i], pgc.V[i], from_box.width, to_box.left + to_box.width)
-            U1.append(b[1])
-            V1.append(b[2])
-            
-        return ParsedGcode(X1, Y1, U1, V1, pgc.TAG, pgc.KIND)
+        a = isect_lines_plane_v3(c1_3d, c2_3d, (to_box.left, 0, 0), p_no)
+        b = isect_lines_plane_v3(c1_3d, c2_3d, (to_box.left + to_box.width, 0, 0), p_no)
+
+        return ParsedGcode(a[1], a[2], b[1], b[2], pgc.TAG, pgc.KIND)
 
 
     def calc_vertices(self, pgc: ParsedGcode, gbox: GcodeBox, points):
@@ -150,19 +196,14 @@ class GcodePlotter():
         z = np.array(pgc.Y[:points], np.float64)
         z = np.append(z,np.array(pgc.V[:points], np.float64))
         
-        i = []
-        j = []
-        k = []
-        for a in range(points-1):
-            #first triangle
-            i.append(a)
-            j.append(a+points)
-            k.append(a+1)
-            
-            #second triangle
-            i.append(a+points)
-            j.append(a+points+1)
-            k.append(a+1) 
+        # two triangles per quad between point a and a+1 on both sides:
+        # (a, a+points, a+1) and (a+points, a+points+1, a+1)
+        a = np.arange(max(points-1, 0))
+        i = np.empty(2*len(a), int)
+        j = np.empty(2*len(a), int)
+        k = np.empty(2*len(a), int)
+        i[0::2], j[0::2], k[0::2] = a, a+points, a+1
+        i[1::2], j[1::2], k[1::2] = a+points, a+points+1, a+1
 
         intensity = (x< gbox.left) | (x> gbox.left + gbox.width) \
                     | (y< gbox.inset) | (y>gbox.depth + gbox.inset) \
@@ -184,8 +225,49 @@ class GcodePlotter():
         return {'x':x, 'y':y, 'z':z, 'i':i, 'j':j, 'k':k}
 
 
-    def plot_gcode(self, pgcode : ParsedGcode, num_of_points=-1, draw_cutting_path = True, draw_foam_block=True):
-        '''returns a plotly figure object visualizing the cut path (optional) and the wing foam paths'''
+    def decimate(self, pgc: ParsedGcode, max_points):
+        ''' indices of the points to keep to draw pgc with about max_points points.
+            Points that bend the path the most on either side of the machine are kept first 
+            (Visvalingam effective area), the leading and trailing edge, every point that 
+            is not part of the profile (stock cuts, initial move) and the ends of each tagged
+            section are always kept '''
+        n = len(pgc)
+        if max_points is None or n <= max_points:
+            return np.arange(n)
+
+        X, Y, U, V = [np.asarray(a, float) for a in (pgc.X, pgc.Y, pgc.U, pgc.V)]
+        tags = pgc.TAG
+
+        keep = tags != TAG_BITS["profile"]
+        keep[[0, -1]] = True
+        changed = tags[1:] != tags[:-1]
+        keep[1:] |= changed
+        keep[:-1] |= changed
+        for a in (X, U):
+            keep[np.argmin(a)] = True
+            keep[np.argmax(a)] = True
+
+        # area of the triangle each point forms with its neighbours, largest of both sides
+        area = np.zeros(n)
+        for a, b in ((X, Y), (U, V)):
+            tri = 0.5 * np.abs((a[1:-1] - a[:-2]) * (b[2:] - b[:-2]) - (a[2:] - a[:-2]) * (b[1:-1] - b[:-2]))
+            area[1:-1] = np.maximum(area[1:-1], tri)
+
+        budget = max_points - np.count_nonzero(keep)
+        candidates = np.flatnonzero(~keep)
+        if budget >= len(candidates):
+            keep[candidates] = True
+        elif budget > 0:
+            best = np.argpartition(-area[candidates], budget - 1)[:budget]
+            keep[candidates[best]] = True
+
+        return np.flatnonzero(keep)
+
+
+    def plot_gcode(self, pgcode : ParsedGcode, num_of_points=-1, draw_cutting_path = True, draw_foam_block=True, max_points=None):
+        '''returns a plotly figure object visualizing the cut path (optional) and the wing foam paths
+        with max_points set, the meshes are drawn from at most about that many points, 
+        the stats are always calculated on all the points'''
 
         stats = {}
         pgcode_wing = self.project_coords(pgcode, self.mbox, self.fbox)
@@ -196,6 +278,15 @@ class GcodePlotter():
         wing_vertices = self.calc_vertices(pgcode_wing, self.fbox, num_of_points )
         stats['wing'] = self.summarize_vertices(wing_vertices)
 
+        draw_pgcode = pgcode
+        draw_points = num_of_points
+        if max_points is not None and num_of_points > max_points:
+            shown = pgcode.take(np.arange(num_of_points))
+            draw_pgcode = shown.take(self.decimate(shown, max_points))
+            draw_points = len(draw_pgcode)
+            wing_vertices = self.calc_vertices(self.project_coords(draw_pgcode, self.mbox, self.fbox), 
+                                               self.fbox, draw_points)
+
         fig = go.Figure() 
         fig = self.setup_fig(fig)
 
@@ -205,6 +296,8 @@ class GcodePlotter():
         if draw_cutting_path:
             pillar_vertices = self.calc_vertices(pgcode, self.mbox, num_of_points )
             stats['machine'] = self.summarize_vertices(pillar_vertices)
+            if draw_pgcode is not pgcode:
+                pillar_vertices = self.calc_vertices(draw_pgcode, self.mbox, draw_points )
             fig.add_trace(
                 go.Mesh3d(
                     **pillar_vertices, 
@@ -212,7 +305,7 @@ class GcodePlotter():
                     showscale=False, 
                     cmin=0, cmax=1,
                     colorscale=[[0, 'gold'],[1, 'red']],
-                    showlegend= True, name='Cut')
+                    showlegend= True, name='Cut', meta=PROGRESS_META)
                 )
             
         if draw_foam_block:
@@ -232,7 +325,7 @@ class GcodePlotter():
                 **wing_vertices,
                 showscale=False,
                 colorscale=[[0, 'green'], [1, 'red']],
-                cmin = 0, cmax=1, showlegend=True, name='Wing'
+                cmin = 0, cmax=1, showlegend=True, name='Wing', meta=PROGRESS_META
             )
         )
 
@@ -319,16 +412,17 @@ class GcodePlotter():
                 )
             )
 
-        stats['left'] = {"x":pgcode_wing.X, "y":pgcode_wing.Y}
-        stats['right'] = {"x":pgcode_wing.U, "y":pgcode_wing.V}
+        stats['left'] = {"x":pgcode_wing.X.tolist(), "y":pgcode_wing.Y.tolist()}
+        stats['right'] = {"x":pgcode_wing.U.tolist(), "y":pgcode_wing.V.tolist()}
         
         #fig.update_scenes(xaxis_autorange="reversed")
         return fig, stats
 
 
     def plot_gcode_2dplan(self, pgcode : ParsedGcode, num_of_points=-1, 
-                draw_cutting_path = True, draw_foam_block=True, draw_machine_block = True):
-        '''returns a plotly figure object visualizing the cut path (optional) and the wing foam paths'''
+                draw_cutting_path = True, draw_foam_block=True, draw_machine_block = True, max_plan_points=None):
+        '''returns a plotly figure object visualizing the cut path (optional) and the wing foam paths
+        the wing plan is drawn through its corners only, unless max_plan_points is set'''
 
 
 
@@ -429,21 +523,7 @@ class GcodePlotter():
         stats['x'] = wing_x
         stats['y'] = wing_y
 
-        x_coords = []
-        y_coords = []
-
-        for i,(x,y) in enumerate(zip(wing_x,wing_y)):
-            if i ==0:
-                prev_x = x
-
-                prev_y = y
-            else:
-                steps = int(max(abs(x - prev_x) + 1,abs(y - prev_y) + 1))
-                x_coords.extend(np.linspace(prev_x,x,steps))
-                y_coords.extend(np.linspace(prev_y,y, steps))
-
-                prev_x = x
-                prev_y = y
+        x_coords, y_coords = self.sample_outline(wing_x, wing_y, max_plan_points)
 
 
         fig.add_trace(
@@ -459,6 +539,18 @@ class GcodePlotter():
         #fig.update_scenes(xaxis_autorange="reversed")
         return fig, stats
 
+    def sample_outline(self, x, y, max_points=None):
+        ''' the outline through the points x, y. Just the points themselves, unless max_points is set,
+            then the edges are filled with evenly spaced points up to about max_points in total '''
+        x = np.asarray(x, float)
+        y = np.asarray(y, float)
+        if max_points is None or max_points <= len(x):
+            return x, y
+
+        dist = np.concatenate(([0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+        t = np.union1d(dist, np.linspace(0, dist[-1], max_points - len(x)))
+        return np.interp(t, dist, x), np.interp(t, dist, y)
+
     def summarize_vertices(self, vertices):
         result = {}
         for ax in ('x','y','z'):
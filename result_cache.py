@@ -0,0 +1,124 @@
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def stage_key(config, stage, *extra):
+    ''' content hash of only the options the output of a regeneration stage depends on
+        (see config_options.STAGE_DEPENDENCIES) plus any extra values that change the result '''
+    h = hashlib.sha256(repr(config.stage_values(stage)).encode())
+    for e in extra:
+        h.update(b"\0")
+        h.update(repr(e).encode())
+    return h.hexdigest()
+
+
+def estimate_nbytes(obj, _seen=None):
+    ''' rough size of a cached value: numpy arrays count their buffers, containers their items '''
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    # objects referring back to their parent (like a gcode formatter) are only counted once
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, dict):
+        return sum(estimate_nbytes(v, _seen) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_nbytes(v, _seen) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return estimate_nbytes(vars(obj), _seen)
+    return sys.getsizeof(obj)
+
+
+class DrawResult():
+    ''' everything the Draw callback needs that only depends on the config, not on what is being drawn '''
+    def __init__(self, gcode, pgc, bbox, wing_plan, left_offset, wing_stats, gc=None, gcode_key=None):
+        self.gcode = gcode
+        self.pgc = pgc
+        self.bbox = bbox
+        self.wing_plan = wing_plan
+        self.left_offset = left_offset
+        self.wing_stats = wing_stats
+        # the cut moves with the configured kerf and the stage_key "gcode" they were formatted for,
+        # so a change to the gcode options only formats the moves again
+        self.gc = gc
+        self.gcode_key = gcode_key
+
+
+class ResultCache():
+    ''' Thread-safe LRU cache bounded by number of entries and by an estimated byte budget,
+        entries optionally expire ttl seconds after they were stored '''
+
+    def __init__(self, max_entries=32, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self.nbytes -= self._entries.pop(key)[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                # would evict everything else and still not fit
+                return value
+            expires = None if self.ttl is None else time.monotonic() + self.ttl
+            self._entries[key] = (value, size, expires)
+            self.nbytes += size
+            self._evict()
+        return value
+
+    def get_or_create(self, key, create):
+        ''' returns the cached value for key, calling create() and caching its result on a miss '''
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, create())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        if self.ttl is not None:
+            now = time.monotonic()
+            for key in [k for k, (_, _, expires) in self._entries.items() if expires < now]:
+                self.nbytes -= self._entries.pop(key)[1]
+        while self._entries and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self.nbytes -= size
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
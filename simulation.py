@@ -0,0 +1,358 @@
+''' Replays a cut against the foam block of [Panel] before it goes to the machine.
+
+    python simulation.py wing.cfg                   simulates the gcode generated for wing.cfg
+    python simulation.py wing.cfg -g wing.gcode     replays a gcode file against the block of wing.cfg
+
+    The wire is a straight line between the pillars, so on every slice of the block parallel to the
+    ribs it traces the same moves, interpolated between both ribs. Each slice is rasterized into an
+    occupancy grid: the wire melts the foam within kerf of its centre, the same distance the cutting
+    strategy offsets the profiles by. The report compares what is left with the profiles without kerf,
+    the results are accurate to about the grid resolution.
+'''
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import config_options
+import dxf_parser
+import gcode_buffer
+import gcode_gen
+import plotting
+import utils
+
+
+class CutSimulator():
+
+    def __init__(self, plotter: plotting.GcodePlotter, kerf=(0., 0.), resolution=0.25, slices=3, max_deviation=5.,
+                 rib_planes=None):
+        ''' plotter gives the machine and foam block, kerf is (left rib, right rib), resolution the grid cell size,
+            slices the number of slices from the left to the right rib and max_deviation how far from the
+            profile the deviation is measured. rib_planes are the (point, normal) of both ribs in the coordinates
+            of GcodeGen.rib_planes, by default the faces of the foam block '''
+        self.plotter = plotter
+        self.fbox = plotter.fbox
+        self.kerf = kerf
+        self.resolution = resolution
+        self.slices = max(slices, 2)
+        self.max_deviation = max_deviation
+        if rib_planes is None:
+            rib_planes = [(np.array([x, 0., 0.]), np.array([1., 0., 0.]))
+                          for x in (self.fbox.left, self.fbox.left + self.fbox.width)]
+        self.rib_planes = rib_planes
+
+        # the slices are parallel to the ribs, which are turned by the angle RotateWing rotates the wing with.
+        # Positions on a slice are measured horizontally along it from where it crosses the machine's
+        # horizontal zero, and vertically. slice_x is where along the wire that crossing is
+        (p0, n), (p1, _) = rib_planes
+        n = np.asarray(n, float) * np.sign(n[0]) / np.hypot(n[0], n[1])
+        self.cos, self.sin = n[0], n[1]
+        s = self.slice_positions()[:, None]
+        points = (1 - s) * np.asarray(p0, float) + s * np.asarray(p1, float)
+        self.slice_x = points[:, 0] + self.sin * points[:, 1] / self.cos
+        self.slice_width = abs((np.asarray(p1, float) - p0) @ n) / (self.slices - 1)
+
+        # rows from the bottom up, columns from the inset onwards, of the cells of every slice
+        self.origin = self.fbox.inset / self.cos
+        self.shape = (max(int(np.ceil(self.fbox.height / resolution)), 1),
+                      max(int(np.ceil(self.fbox.depth / self.cos / resolution)), 1))
+        # columns of every slice in the foam block, turned slices leave it through its sides
+        x = self.slice_x[:, None] - (self.origin + (np.arange(self.shape[1]) + 0.5) * resolution) * self.sin
+        self.foam = (x >= self.fbox.left) & (x <= self.fbox.left + self.fbox.width)
+
+    def slice_positions(self):
+        ''' position of every slice between the left (0) and the right (1) rib '''
+        return np.linspace(0, 1, self.slices)
+
+    def wire_positions(self, pgc: plotting.ParsedGcode):
+        ''' horizontal and vertical position of the wire on every slice after every move, two (slices, moves) arrays '''
+        n = len(pgc)
+        c1_3d = (np.zeros(n), pgc.X, pgc.Y)
+        c2_3d = (np.full(n, self.plotter.mbox.width, float), pgc.U, pgc.V)
+        Y, Z = np.empty((self.slices, n)), np.empty((self.slices, n))
+        for s in range(self.slices):
+            x, y, Z[s] = utils.isect_lines_plane_v3(c1_3d, c2_3d, (self.slice_x[s], 0, 0), (self.cos, self.sin, 0))
+            Y[s] = y * self.cos - (x - self.slice_x[s]) * self.sin
+        return Y, Z
+
+    def _cells(self, y, z):
+        ''' row and column of the cells at the positions y, z, outside the grid as well '''
+        return (np.floor((z - self.fbox.bottom) / self.resolution).astype(int),
+                np.floor((y - self.origin) / self.resolution).astype(int))
+
+    def _in_foam(self, s, r, c):
+        ''' whether the cells at rows r and columns c of slice s are in the foam block '''
+        rows, cols = self.shape
+        inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+        inside[inside] = self.foam[s][c[inside]]
+        return inside
+
+    def _disk(self, radius, width):
+        ''' flat index offsets of the cells within radius of a cell, in a grid of the given width '''
+        r = int(np.floor(radius / self.resolution))
+        dr, dc = np.mgrid[-r:r + 1, -r:r + 1]
+        inside = (dr ** 2 + dc ** 2) * self.resolution ** 2 <= radius ** 2
+        return (dr[inside] * width + dc[inside]).astype(np.int64)
+
+    def _sweep(self, y, z, radius):
+        ''' cells of one slice within radius of the wire moving through the points y, z '''
+        rows, cols = self.shape
+        # the wire is sampled at least once per cell along every move, so it leaves no gaps
+        dy, dz = np.diff(y), np.diff(z)
+        steps = np.maximum(np.ceil(np.hypot(dy, dz) / self.resolution), 1).astype(np.int64)
+        seg = np.repeat(np.arange(len(dy)), steps)
+        t = (np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[seg]
+        sy = np.concatenate((y[seg] + t * dy[seg], y[-1:]))
+        sz = np.concatenate((z[seg] + t * dz[seg], z[-1:]))
+
+        # a wire centre outside the block still melts the cells within radius of it, the grid is padded
+        # so a disk around any centre near enough to reach the block stays within its row
+        reach = int(np.floor(radius / self.resolution))
+        pad = 2 * reach + 1
+        width = cols + 2 * pad
+        r, c = self._cells(sy, sz)
+        near = (r >= -reach) & (r < rows + reach) & (c >= -reach) & (c < cols + reach)
+        centres = np.unique((r[near] + pad) * width + c[near] + pad)
+
+        grid = np.zeros((rows + 2 * pad) * width, bool)
+        grid[(centres[:, None] + self._disk(radius, width)[None, :]).ravel()] = True
+        return grid.reshape(rows + 2 * pad, width)[pad:-pad, pad:-pad]
+
+    def removed(self, pgc: plotting.ParsedGcode):
+        ''' occupancy grid of the foam the wire melts, (slices, rows, columns) booleans.
+            The wire is on for the whole program, so every move counts, fast moves included '''
+        Y, Z = self.wire_positions(pgc)
+        kerf = (1 - self.slice_positions()) * self.kerf[0] + self.slice_positions() * self.kerf[1]
+        grid = np.zeros((self.slices,) + self.shape, bool)
+        if len(pgc):
+            for s in range(self.slices):
+                grid[s] = self._sweep(Y[s], Z[s], kerf[s])
+        return grid & self.foam[:, None, :]
+
+    def _fill(self, y, z):
+        ''' cells of one slice with their centre inside the polygon y, z (even-odd rule), filled a row at a time '''
+        rows, cols = self.shape
+        y0, z0 = y, z
+        y1, z1 = np.roll(y, -1), np.roll(z, -1)
+        # rows whose centre is in the half open vertical span of an edge cross it once
+        lo = np.clip(np.ceil((np.minimum(z0, z1) - self.fbox.bottom) / self.resolution - 0.5), 0, rows).astype(np.int64)
+        hi = np.clip(np.ceil((np.maximum(z0, z1) - self.fbox.bottom) / self.resolution - 0.5), 0, rows).astype(np.int64)
+        edge = np.repeat(np.arange(len(y)), hi - lo)
+        row = np.arange(len(edge)) - np.repeat(np.cumsum(hi - lo) - (hi - lo), hi - lo) + lo[edge]
+        zc = self.fbox.bottom + (row + 0.5) * self.resolution
+        yc = y0[edge] + (zc - z0[edge]) * (y1[edge] - y0[edge]) / (z1[edge] - z0[edge])
+        col = np.clip(np.ceil((yc - self.origin) / self.resolution - 0.5), 0, cols).astype(np.int64)
+
+        toggles = np.zeros((rows, cols + 1), np.int64)
+        np.add.at(toggles, (row, col), 1)
+        return (np.cumsum(toggles, axis=1)[:, :cols] % 2).astype(bool)
+
+    def _erode(self, mask, depth):
+        ''' cells of one slice more than depth inside mask, all the cells within depth of them are in mask '''
+        rows, cols = mask.shape
+        reach = int(np.floor(depth / self.resolution))
+        width = cols + 2 * reach
+        padded = np.zeros((rows + 2 * reach, width), bool)
+        padded[reach:reach + rows, reach:reach + cols] = mask
+        flat = padded.ravel()
+        idx = np.flatnonzero(flat)
+        keep = np.ones(len(idx), bool)
+        for offset in self._disk(depth, width):
+            keep &= flat[idx + offset]
+        flat = np.zeros_like(flat)
+        flat[idx[keep]] = True
+        return flat.reshape(padded.shape)[reach:reach + rows, reach:reach + cols]
+
+    def profile_points(self, target: plotting.ParsedGcode):
+        ''' indices of the moves of target tracing the profile, without the spikes out to the
+            leading and trailing edge offsets and back '''
+        idx = np.flatnonzero(target.TAG & gcode_buffer.TAG_BITS["profile"])
+        p = np.column_stack((target.X, target.Y, target.U, target.V))[idx]
+        # repeated points and points both neighbours of which are the same, the profile is closed
+        repeated = np.all(np.isclose(p, np.roll(p, 1, axis=0)), axis=1)
+        p, idx = p[~repeated], idx[~repeated]
+        spike = np.all(np.isclose(np.roll(p, 1, axis=0), np.roll(p, -1, axis=0)), axis=1)
+        return idx[~spike]
+
+    def deviation(self, removed, target: plotting.ParsedGcode):
+        ''' signed distance from every profile point of target to the surface the cut leaves, along the outward normal
+            of the profile on every slice, (slices, points). Positive where foam is left outside the profile, negative
+            where the wire cut into it, clipped to max_deviation. Outside the block there is no foam to begin with.
+            Returns the indices of the profile points in target and the deviations '''
+        idx = self.profile_points(target)
+        Y, Z = self.wire_positions(target.take(idx))
+        step = self.resolution / 2
+        k = int(np.ceil(self.max_deviation / step))
+        t = np.arange(-k, k + 1) * step
+
+        result = np.full(Y.shape, np.nan)
+        for s in range(self.slices):
+            y, z = Y[s], Z[s]
+            # outward normals, the sign of the area tells which way the profile goes round
+            ty, tz = np.roll(y, -1) - np.roll(y, 1), np.roll(z, -1) - np.roll(z, 1)
+            length = np.hypot(ty, tz)
+            length[length == 0] = 1
+            orientation = np.sign(np.sum(y * np.roll(z, -1) - np.roll(y, -1) * z)) or 1
+            ny, nz = orientation * tz / length, -orientation * ty / length
+
+            r, c = self._cells(y[:, None] + t * ny[:, None], z[:, None] + t * nz[:, None])
+            in_foam = self._in_foam(s, r, c)
+            gone = ~in_foam
+            gone[in_foam] = removed[s][r[in_foam], c[in_foam]]
+            # the surface nearest the profile point: walking out while there is foam at the point,
+            # walking in while there is none. Walking through a thin profile would find the far side
+            out, into = gone[:, k:], ~gone[:, k::-1]
+            left = np.where(out.any(axis=1), np.argmax(out, axis=1) * step, self.max_deviation)
+            cut = np.where(into.any(axis=1), -np.argmax(into, axis=1) * step, -self.max_deviation)
+            result[s] = np.clip(np.where(gone[:, k], cut, left), -self.max_deviation, self.max_deviation)
+        return idx, result
+
+    def wire_exits(self, pgc: plotting.ParsedGcode):
+        ''' moves that start with the wire in the foam and end with it outside of the block on every slice,
+            with the sides of the block it is out of. A turned slice also ends at the left and right of the block,
+            the wire runs through the whole block so those are not sides it leaves through '''
+        Y, Z = self.wire_positions(pgc)
+        f = self.fbox
+        # where the slices meet the wire in machine coordinates, along the wire and horizontally
+        x, h = self.slice_x[:, None] - Y * self.sin, Y * self.cos
+        outside = (("bottom", Z < f.bottom), ("top", Z > f.bottom + f.height),
+                   ("inset", h < f.inset), ("depth", h > f.inset + f.depth),
+                   ("left", x < f.left), ("right", x > f.left + f.width))
+        in_foam = ~np.any([out for _, out in outside], axis=0).all(axis=0)
+        exits = np.flatnonzero(in_foam[:-1] & ~in_foam[1:]) + 1
+
+        result = []
+        for i in exits.tolist():
+            y, z = Y[:, i], Z[:, i]
+            sides = [side for side, out in outside[:4] if out[:, i].any()]
+            result.append({"move": i, "tags": gcode_buffer.tag_names(int(pgc.TAG[i])), "sides": sides,
+                           "left": [float(y[0]), float(z[0])], "right": [float(y[-1]), float(z[-1])]})
+        return result
+
+    def simulate(self, pgc: plotting.ParsedGcode, target: plotting.ParsedGcode = None, tolerance=None):
+        ''' replays pgc against the foam block, target the profiles without kerf to measure the deviation against.
+            Profile points in the foam that are cut more than tolerance, by default two cells, into the profile are
+            overcuts, the overcut volume counts the cells further than tolerance into the profile. Profile points outside the foam block are reported apart, the block is too small for them '''
+        tolerance = 2 * self.resolution if tolerance is None else tolerance
+        removed = self.removed(pgc)
+        cell = self.resolution ** 2
+        # trapezoid rule across the slices
+        weights = np.full(self.slices, self.slice_width)
+        weights[[0, -1]] /= 2
+
+        report = {"moves": len(pgc), "resolution": self.resolution, "slices": self.slices, "grid": list(self.shape),
+                  "removed_volume": float(removed.sum(axis=(1, 2)) @ weights * cell),
+                  "wire_exits": self.wire_exits(pgc)}
+        if target is None:
+            return report
+
+        idx, dev = self.deviation(removed, target)
+        Y, Z = self.wire_positions(target.take(idx))
+        outside = np.array([~self._in_foam(s, *self._cells(Y[s], Z[s])) for s in range(self.slices)])
+        over = (dev < -tolerance) & ~outside
+        inside = np.array([self._fill(Y[s], Z[s]) for s in range(self.slices)])
+        report["profile_volume"] = float(inside.sum(axis=(1, 2)) @ weights * cell)
+        # like the overcut points, only cells deeper than tolerance into the profile, the boundary is rasterized
+        deep = np.array([self._erode(inside[s], tolerance) for s in range(self.slices)])
+        report["overcut_volume"] = float((deep & removed).sum(axis=(1, 2)) @ weights * cell)
+        report["deviation"] = {"min": float(dev.min()), "max": float(dev.max()),
+                               "mean_abs": float(np.abs(dev).mean()), "rms": float(np.sqrt(np.mean(dev ** 2)))}
+        report["overcuts"] = [{"slice": float(self.slice_positions()[s]), "move": int(idx[p]), "depth": float(-dev[s, p]),
+                               "position": [float(Y[s, p]), float(Z[s, p])]}
+                              for s, p in zip(*np.nonzero(over))]
+        report["outside_block"] = [{"slice": float(self.slice_positions()[s]), "move": int(idx[p]),
+                                    "position": [float(Y[s, p]), float(Z[s, p])]}
+                                   for s, p in zip(*np.nonzero(outside))]
+        report["tolerance"] = tolerance
+        return report
+
+
+def parse_gcode(lines, axis_mapping="X,Y,Z,A"):
+    ''' ParsedGcode of the moves in gcode lines, with the axes in the order of [Gcode] AxisMapping.
+        A gcode file has no tags, every move counts as a plain move '''
+    axes = {a.strip().upper(): i for i, a in enumerate(axis_mapping.split(","))}
+    moves = dxf_parser.parse_gcode_moves(lines, axes)
+    n = len(moves)
+    return plotting.ParsedGcode(moves[:, 0], moves[:, 1], moves[:, 2], moves[:, 3],
+                                np.zeros(n, np.uint16), np.full(n, gcode_buffer.MOVE))
+
+
+def simulate_config(cfg, profile_cache, gcode_lines=None, resolution=0.25, slices=3):
+    ''' report of the gcode generated for cfg, or of gcode_lines, replayed against the foam block of cfg '''
+    get_config = cfg.get_config
+    gc_gen = gcode_gen.GcodeGen(cfg, profile_cache)
+    gc, bbox, wing_plan = gc_gen.gen_gcode(with_target=True)
+    plotter = plotting.GcodePlotter(get_config('Machine',"Width"), get_config('Machine',"Height"), get_config('Machine',"Depth"),
+                                    gc_gen.left_offset, bbox[1,0] - bbox[0,0],
+                                    get_config('Panel','Bottom'), get_config('Panel','Height'),
+                                    get_config('Panel','Inset'), get_config('Panel','Depth'), wing_plan, bbox)
+
+    # the profiles without kerf, placed where the cut placed them
+    x, y, u, v = gc_gen.target
+    target = plotting.ParsedGcode(x, y, u, v, np.full(len(x), gcode_buffer.TAG_BITS["profile"]),
+                                  np.full(len(x), gcode_buffer.MOVE))
+
+    if gcode_lines is None:
+        pgc = plotting.ParsedGcode.fromgcode(gc)
+    else:
+        pgc = parse_gcode(gcode_lines, get_config("Gcode","AxisMapping"))
+
+    # root and tip kerf, in the order of the faces
+    kerf = gcode_gen.validate_kerf(get_config('Machine',"Kerf"))
+    if get_config('Wing','TipChordSide') != "right":
+        kerf = (kerf[1], kerf[0])
+
+    return CutSimulator(plotter, kerf, resolution, slices, rib_planes=gc_gen.rib_planes).simulate(pgc, target)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the cut of a wing config against its foam block")
+    parser.add_argument("config", help="wing config file")
+    parser.add_argument("-g", "--gcode", default=None, help="gcode file to replay instead of the generated gcode")
+    parser.add_argument("-r", "--resolution", type=float, default=0.25, help="grid cell size")
+    parser.add_argument("-s", "--slices", type=int, default=3, help="slices from the root to the tip face")
+    parser.add_argument("-p", "--profiles", default="profiles", help="profile cache directory")
+    parser.add_argument("--json", action="store_true", help="print the whole report as json")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        cfg = config_options.Config.from_string(f.read())
+    if cfg.validation:
+        print("Invalid config: %s" % "; ".join(cfg.validation))
+        return 1
+
+    start = time.perf_counter()
+    if args.gcode is None:
+        report = simulate_config(cfg, gcode_gen.ProfileCache(args.profiles), None, args.resolution, args.slices)
+    else:
+        with open(args.gcode) as f:
+            report = simulate_config(cfg, gcode_gen.ProfileCache(args.profiles), f, args.resolution, args.slices)
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(report, indent=1))
+        return 0
+
+    dev = report["deviation"]
+    print("%d moves on a %dx%d grid of %.2f, %d slices, in %.2fs" % (report["moves"], report["grid"][0], report["grid"][1],
+                                                                     report["resolution"], report["slices"], elapsed))
+    print("removed %.0f of foam, profile %.0f, overcut %.1f" % (report["removed_volume"], report["profile_volume"],
+                                                                 report["overcut_volume"]))
+    print("deviation from the profile: min %.3f max %.3f mean %.3f rms %.3f" % (dev["min"], dev["max"],
+                                                                                 dev["mean_abs"], dev["rms"]))
+    print("%d profile points outside the foam block" % len(report["outside_block"]))
+    for o in report["outside_block"][:10]:
+        print("outside the block at move %d, slice %.2f (%.2f, %.2f)" % (o["move"], o["slice"], *o["position"]))
+    print("%d profile points cut deeper than %.2f into the profile" % (len(report["overcuts"]), report["tolerance"]))
+    for o in sorted(report["overcuts"], key=lambda o: -o["depth"])[:10]:
+        print("overcut %.3f deep at move %d, slice %.2f (%.2f, %.2f)" % (o["depth"], o["move"], o["slice"], *o["position"]))
+    for e in report["wire_exits"]:
+        print("wire leaves the foam through the %s at move %d %s, left (%.2f, %.2f) right (%.2f, %.2f)" % (
+            "/".join(e["sides"]), e["move"], ",".join(e["tags"]), *e["left"], *e["right"]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
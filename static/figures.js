@@ -0,0 +1,67 @@
+// Clientside callbacks for the figures of the Draw callback.
+// Data arrays arrive as {"dtype": "u1" | "u2" | "i4" | "f4", "bdata": base64} (see plotting.encode_array)
+// and are turned back into typed arrays, which plotly.js plots directly.
+
+var TYPED_ARRAYS = {"u1": Uint8Array, "u2": Uint16Array, "i4": Int32Array, "f4": Float32Array};
+
+function decode_array(v) {
+    if (!v || v.bdata === undefined) {
+        return v;
+    }
+    var s = atob(v.bdata);
+    var bytes = new Uint8Array(s.length);
+    for (var n = 0; n < s.length; n++) {
+        bytes[n] = s.charCodeAt(n);
+    }
+    return new TYPED_ARRAYS[v.dtype](bytes.buffer);
+}
+
+function decode_figure(fig) {
+    if (!fig || !fig.data) {
+        return {};
+    }
+    var data = fig.data.map(function(trace) {
+        var t = Object.assign({}, trace);
+        ["x", "y", "z", "i", "j", "k", "intensity"].forEach(function(attr) {
+            if (t[attr] !== undefined) {
+                t[attr] = decode_array(t[attr]);
+            }
+        });
+        return t;
+    });
+    return Object.assign({}, fig, {data: data});
+}
+
+// the 3d figure is only decoded once, not on every move of the point slider
+var last_3d_figure = null;
+var last_3d_decoded = null;
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figures: {
+        decode_figure: decode_figure,
+
+        // shows the 3d meshes up to the point slider, the first 2*(n-1) triangles of a mesh
+        // marked with meta "progress" (plotting.PROGRESS_META) show the cut up to its n-th point
+        reveal_3d_figure: function(fig, value) {
+            if (fig !== last_3d_figure) {
+                last_3d_figure = fig;
+                last_3d_decoded = decode_figure(fig);
+            }
+            fig = last_3d_decoded;
+            if (!fig.data || value >= 100) {
+                return fig;
+            }
+            var data = fig.data.map(function(trace) {
+                if (trace.meta !== "progress") {
+                    return trace;
+                }
+                var points = trace.x.length / 2;
+                var triangles = 2 * Math.max(Math.floor(value / 100 * points) - 1, 0);
+                return Object.assign({}, trace, {i: trace.i.slice(0, triangles),
+                                                 j: trace.j.slice(0, triangles),
+                                                 k: trace.k.slice(0, triangles)});
+            });
+            return Object.assign({}, fig, {data: data});
+        }
+    }
+});
@@ -16,7 +16,8 @@ class TrailingEdgeCuttingStrategy(CuttingStrategyBase):
                 root_profile_thickness, tip_profile_thickness,
                 vertical_offset_left = 0, 
                 vertical_offset_right = None,   vertical_align_profiles = "default",  
-                dihedral = 0.0, inverted = False, rotate=False, fix_left_offset = None, tail_stock_angle=0):
+                dihedral = 0.0, inverted = False, rotate=False, fix_left_offset = None, tail_stock_angle=0,
+                with_target=False):
 
  
         m = self.machine
@@ -28,6 +29,9 @@ class TrailingEdgeCuttingStrategy(CuttingStrategyBase):
         profile2 = m.panel.left_rib.profile
         profile1 = m.panel.right_rib.profile
 
+        # without kerf, the surface the cut should leave behind
+        target1, target2 = profile1, profile2
+
         # Offset profiles for Kerf Value
         profile1 = Profile.offset_around_profiles(
             profile1, m.kerf[0], m.kerf[0])
@@ -156,6 +160,20 @@ class TrailingEdgeCuttingStrategy(CuttingStrategyBase):
 
 
 
+        self.target = self.rib_planes = None
+        if with_target:
+            # machine positions tracing the profiles without kerf, placed like the cut profiles
+            # and scaled to the requested thickness themselves
+            target = []
+            for t, thickness, vertical_offset in ((target1, root_profile_thickness, vertical_offset_left),
+                                                  (target2, tip_profile_thickness, vertical_offset_right)):
+                scale = thickness / 100. / self.get_profile_thickness(t) if thickness > 0 else 1.
+                for surface in (t.top, t.bottom):
+                    target.append([Coordinate(profile_max - c.x + horizontal_offset + te_offset,
+                                              scale * mult * c.y + vertical_offset) for c in reversed(surface.coordinates)])
+            self.target = self.profile_moves(*target)
+            self.rib_planes = [self.rib_plane(m.left_offset), self.rib_plane(m.left_offset + m.panel.width)]
+
         # Trim the overlap
         # profile1 = Profile.trim_overlap(profile1)
         # profile2 = Profile.trim_overlap(profile2)
@@ -346,26 +364,94 @@ class TrailingEdgeCuttingStrategy(CuttingStrategyBase):
 
         return {"x":pos[0][0],"y":pos[0][1],"u":pos[1][0],"v":pos[1][1]}
 
+    def calculate_moves(self, x1, y1, x2, y2):
+        """
+        Vectorized calculate_move - creates the XYUV positions for the machine for every pair of
+        points on the left (x1, y1) and right (x2, y2) profiles in one array operation.
+
+        Args:
+            x1, y1 (np.array): points on the left profile
+            x2, y2 (np.array): points on the right profile
+
+        Returns:
+            Tuple of np.array: (x, y, u, v)
+        """
+        m = self.machine
+        n = len(x1)
+        a0 = np.full(n, 0 + m.left_offset, float)
+        b0 = np.full(n, m.panel.width + m.left_offset, float)
+
+        if self.rotate:
+            # rotate each pair together, same as calculate_move does
+            pairs = np.empty((2 * n, 2))
+            pairs[0::2, 0], pairs[0::2, 1] = a0, x1
+            pairs[1::2, 0], pairs[1::2, 1] = b0, x2
+            pairs = np.atleast_2d(utils.rotate(pairs, self.origin, self.angle))
+            pairs += np.array([self.h_delta, self.v_delta])
+            a0, x1 = pairs[0::2, 0], pairs[0::2, 1]
+            b0, x2 = pairs[1::2, 0], pairs[1::2, 1]
+
+        c1_3d = (a0, np.asarray(x1, float), np.asarray(y1, float))
+        c2_3d = (b0, np.asarray(x2, float), np.asarray(y2, float))
+        p_no = (1, 0, 0)
+        a = utils.isect_lines_plane_v3(c1_3d, c2_3d, (0, 0, 0), p_no)
+        b = utils.isect_lines_plane_v3(c1_3d, c2_3d, (m.width, 0, 0), p_no)
+
+        return a[1], a[2], b[1], b[2]
+
+    def rib_plane(self, x):
+        """
+        Plane of the rib at x along the wire, after rotating the wing
+
+        Returns:
+            Tuple of np.array: point on the plane and its normal, in the (x along the wire, horizontal, vertical)
+            coordinates calculate_move uses
+        """
+        point, normal = np.array([x, 0.]), np.array([1., 0.])
+        if self.rotate:
+            point = utils.rotate(point, self.origin, self.angle) + np.array([self.h_delta, self.v_delta])
+            normal = utils.rotate(normal, (0, 0), self.angle)
+        return np.append(point, 0.), np.append(normal, 0.)
+
+    def profile_moves(self, top1, bottom1, top2, bottom2):
+        """
+        Machine positions around both profiles given by their top and bottom coordinates, along the
+        top and back along the bottom as the profile is cut, without the leading and trailing edge offsets
+
+        Returns:
+            Tuple of np.array: (x, y, u, v)
+        """
+        pct = np.arange(self.machine.profile_points + 1) / self.machine.profile_points
+        x1, y1 = utils.interpolate_around_profile_dist_pct(top1, pct)
+        x2, y2 = utils.interpolate_around_profile_dist_pct(top2, pct)
+        bx1, by1 = utils.interpolate_around_profile_dist_pct(bottom1, pct[::-1])
+        bx2, by2 = utils.interpolate_around_profile_dist_pct(bottom2, pct[::-1])
+        return self.calculate_moves(np.concatenate((x1, bx1)), np.concatenate((y1, by1)),
+                                    np.concatenate((x2, bx2)), np.concatenate((y2, by2)))
+
+    def _move_along(self, x1, y1, x2, y2, options, dwell_time=None):
+        """
+        Cut through all the points returned by calculate_moves straight into the gcode buffer,
+        optionally dwelling on the first point
+        """
+        x, y, u, v = self.calculate_moves(x1, y1, x2, y2)
+        if dwell_time is None or len(x) == 0:
+            self.machine.gc.moves(x, y, u, v, options)
+        else:
+            self.machine.gc.moves(x[:1], y[:1], u[:1], v[:1], options)
+            self.machine.gc.dwell(dwell_time)
+            self.machine.gc.moves(x[1:], y[1:], u[1:], v[1:], options)
+
     def _cut_top_profile(self, profile1, profile2, dwell_time, options=[]):
         # cut top profile
-        c1 = profile1.top.coordinates[0]
-        c2 = profile2.top.coordinates[0]
-
-        a_bounds_min, a_bounds_max = profile1.top.bounds
-        b_bounds_min, b_bounds_max = profile2.top.bounds
-        a_width = a_bounds_max.x - a_bounds_min.x
-        b_width = b_bounds_max.x - b_bounds_min.x
+        pct = np.arange(self.machine.profile_points) / self.machine.profile_points
+        x1, y1 = utils.interpolate_around_profile_dist_pct(profile1.top.coordinates, pct)
+        x2, y2 = utils.interpolate_around_profile_dist_pct(profile2.top.coordinates, pct)
 
-        for i in range(self.machine.profile_points):
-            if i == 0:
-                self.machine.gc.dwell(dwell_time)
-            pct = i / self.machine.profile_points
-            c1 = profile1.top.interpolate_around_profile_dist_pct(pct)
-            c2 = profile2.top.interpolate_around_profile_dist_pct(pct)
-            self.machine.gc.move(self.calculate_move(c1, c2), options)
-            if i == 0:
-                # dwell on first point
-                self.machine.gc.dwell(dwell_time)
+        if len(pct) > 0:
+            self.machine.gc.dwell(dwell_time)
+        # dwell on first point
+        self._move_along(x1, y1, x2, y2, options, dwell_time)
 
         # cut to last point
         self.machine.gc.move(self.calculate_move(profile1.top.coordinates[-1],
@@ -375,22 +461,12 @@ class TrailingEdgeCuttingStrategy(CuttingStrategyBase):
 
     def _cut_bottom_profile(self, profile1, profile2, dwell_time, options):
         # cutting profile from right to left
-        c1 = profile1.top.coordinates[-1]
-        c2 = profile2.top.coordinates[-1]
-        # cut bottom profile
-        a_bounds_min, a_bounds_max = profile1.bottom.bounds
-        b_bounds_min, b_bounds_max = profile2.bottom.bounds
-        a_width = a_bounds_max.x - a_bounds_min.x
-        b_width = b_bounds_max.x - b_bounds_min.x
+        pct = np.arange(self.machine.profile_points, 0 - 1, -1) / self.machine.profile_points
+        x1, y1 = utils.interpolate_around_profile_dist_pct(profile1.bottom.coordinates, pct)
+        x2, y2 = utils.interpolate_around_profile_dist_pct(profile2.bottom.coordinates, pct)
 
-        for i in range(self.machine.profile_points, 0 - 1, -1):
-            pct = i / self.machine.profile_points
-            c1 = profile1.bottom.interpolate_around_profile_dist_pct(pct)
-            c2 = profile2.bottom.interpolate_around_profile_dist_pct(pct)
-            self.machine.gc.move(self.calculate_move(c1, c2), options)
-            if i == self.machine.profile_points:
-                # dwell on first point
-                self.machine.gc.dwell(dwell_time)
+        # dwell on first point
+        self._move_along(x1, y1, x2, y2, options, dwell_time)
 
         self.machine.gc.dwell(dwell_time)
 
@@ -402,11 +478,12 @@ class TrailingEdgeCuttingStrategy(CuttingStrategyBase):
         a_width = a_bounds_max.x - a_bounds_min.x
         b_width = b_bounds_max.x - b_bounds_min.x
 
-        thickness = 0
-        for i in range(self.machine.profile_points):
-            pct = i / self.machine.profile_points
-            c1 = profile1.top.interpolate_around_profile_dist_pct(pct)
-            c2 = profile1.bottom.interpolate_around_profile_dist_pct(pct)
-            thickness = max(thickness, c1.y-c2.y)
+        pct = np.arange(self.machine.profile_points) / self.machine.profile_points
+        _, y1 = utils.interpolate_around_profile_dist_pct(profile1.top.coordinates, pct)
+        _, y2 = utils.interpolate_around_profile_dist_pct(profile1.bottom.coordinates, pct)
+
+        # NaN and negative differences never win, same as the running max starting at 0
+        diff = y1 - y2
+        thickness = np.max(diff[diff > 0], initial=0)
 
         return thickness/a_width
\ No newline at end of file
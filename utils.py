@@ -42,6 +42,55 @@ def project_line(x,y,u,v, width, offset):
     a = isect_line_plane_v3(c1_3d, c2_3d, position, p_no)
     return a
 
+
+def isect_lines_plane_v3(p0, p1, p_co, p_no, epsilon=1e-6):
+    ''' Vectorized version of hotwing_core's isect_line_plane_v3.
+        p0, p1 are (x, y, z) triples of arrays, each element defining one line.
+        Returns a (x, y, z) triple of arrays, NaN where a line is parallel to the plane'''
+    u = [b - a for a, b in zip(p0, p1)]
+    dot = p_no[0] * u[0] + p_no[1] * u[1] + p_no[2] * u[2]
+    w = [a - c for a, c in zip(p0, p_co)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fac = -(p_no[0] * w[0] + p_no[1] * w[1] + p_no[2] * w[2]) / dot
+    fac = np.where(np.abs(dot) > epsilon, fac, np.nan)
+    return tuple(a + d * fac for a, d in zip(p0, u))
+
+
+def interpolate_around_profile_dist_pct(coordinates, pct):
+    ''' Vectorized version of hotwing_core's Surface.interpolate_around_profile_dist_pct.
+        Finds the x-y positions at every percentage in pct of the total distance around the surface
+        in one pass over the cumulative segment lengths.  Returns two arrays (x, y)'''
+    cx = np.array([c.x for c in coordinates], float)
+    cy = np.array([c.y for c in coordinates], float)
+    dx = cx[1:] - cx[:-1]
+    dy = cy[1:] - cy[:-1]
+
+    # cumulative length at the start of every segment, summed in the same order as Surface.length
+    cum = np.concatenate(([0.], np.cumsum(np.sqrt(dx ** 2 + dy ** 2))))
+    pos = cum[-1] * np.asarray(pct, float)
+
+    # first segment whose end lies beyond pos, past the end we extrapolate the last segment
+    seg = np.searchsorted(cum[1:], pos, side='right')
+    past_end = seg == len(dx)
+    seg = np.where(past_end, len(dx) - 1, seg)
+    start = np.where(past_end, seg + 1, seg)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(dx == 0, np.inf, dy / np.where(dx == 0, 1., dx))[seg]
+        b = (pos - np.where(past_end, cum[-1], cum[seg])) / np.sqrt(slope * slope + 1)
+        a = b * slope
+
+    return cx[start] + b, cy[start] + a
+
+
+def ffill(a, initial=0.):
+    ''' Forward fills the NaNs in a with the last valid value before them, initial if there is none'''
+    a = np.concatenate(([initial], a))
+    idx = np.where(np.isnan(a), 0, np.arange(len(a)))
+    np.maximum.accumulate(idx, out=idx)
+    return a[idx][1:]
+
+
 def rotate(p, origin=(0, 0), degrees=0):
     angle = np.deg2rad(degrees)
     R = np.array([[np.cos(angle), -np.sin(angle)],